@@ -1,19 +1,14 @@
-import base64
+import asyncio
 import os
-import io
+import json
+import threading
+import time
 import re  # Added for potential LaTeX extraction
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import pytesseract
-from PIL import Image
-import fitz  # PyMuPDF
-import sympy
-from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication
-import numpy as np
-import google.generativeai as genai # Added for Gemini
-from twilio.rest import Client # Added for Twilio SMS
 from dotenv import load_dotenv # Ensure dotenv is imported
 
 # Load environment variables
@@ -22,7 +17,26 @@ load_dotenv()
 # Import config (assuming app/config.py exists and defines DEBUG)
 # If not, define it here:
 # DEBUG = os.environ.get("DEBUG", "false").lower() == "true"
-from app.config import DEBUG
+from app.config import (
+    DEBUG, WARM_UP_IMPORTS, UPLOAD_MAX_BYTES, PDF_UPLOAD_MAX_BYTES, EXPLAIN_BATCH_MAX_ITEMS, EXPLAIN_ITEM_TIMEOUT, HEDGE_ENABLED, HEDGE_DELAY, HEDGE_DEADLINE, GEMINI_IMAGE_SHRINK,
+    PDF_OCR_ENABLED, PDF_OCR_DPI, OCR_LAYOUT, OCR_LAYOUT_MIN_PIXELS, OCR_REGION_WORKERS, OCR_LANG, OCR_DOWNSCALE,
+    OCR_DESKEW, OCR_THRESHOLD, OCR_AUTOCROP, OCR_TARGET_LINE_HEIGHT, OCR_MAX_PIXELS, OCR_DESKEW_MAX_ANGLE, GEMINI_MODEL,
+)
+from app.ocr import ocr_image_lines
+from app.pdf import extract_pdf_document, pdf_page_count, stream_pdf_pages
+from app.math_explain import explain_math_expression, sandbox_pool
+from app.gemini import GeminiKeyError, gemini_client, image_part, shrink_image
+from app.executor import STAGES, StageOverloaded, run_stage, run_stage_wide, shutdown_executors
+from app.cache import cache_key, cached, result_cache
+from app.circuit import CircuitOpenError, error_text, gemini_breaker
+from app.singleflight import in_flight
+from app.jobs import JobQueue
+from app.uploads import UploadLimitMiddleware, decode_base64, ingest
+from app.images import check_image
+from app import metrics
+from app.lazy import LazyModule, warm_up_in_background
+
+twilio_rest = LazyModule("twilio.rest")  # Added for Twilio SMS
 
 # Configure Twilio client
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
@@ -32,36 +46,20 @@ RECIPIENT_PHONE_NUMBER = os.getenv("RECIPIENT_PHONE_NUMBER")
 
 # Check if Twilio is properly configured
 TWILIO_AVAILABLE = all([TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER, RECIPIENT_PHONE_NUMBER])
-if TWILIO_AVAILABLE:
-    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-    print("Twilio client configured successfully.")
-else:
+if not TWILIO_AVAILABLE:
     print("Warning: Twilio environment variables not set. SMS functionality will not be available.")
+twilio_client = None  # Created by check_dependencies() at startup, or on the first SMS
+_twilio_lock = threading.Lock()
 
 # --- Removed LLaVA Model Loading ---
 
 # Configure Google AI API Key
 # --- IMPORTANT: Store your API Key securely, e.g., in an environment variable ---
-try:
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    if not GOOGLE_API_KEY:
-        print("Warning: GOOGLE_API_KEY environment variable not set. Gemini API will not be available.")
-        GEMINI_AVAILABLE = False
-    else:
-        genai.configure(api_key=GOOGLE_API_KEY)
-        # Check if the vision model is available (optional, but good practice)
-        try:
-            # Attempt to list models to verify API key works (or use a specific check)
-             _ = genai.get_model("models/gemini-1.5-flash") # Or list_models()
-             GEMINI_AVAILABLE = True
-             print("Google AI (Gemini) configured successfully.")
-        except Exception as api_err:
-             print(f"Warning: Google AI API key might be invalid or configuration failed: {api_err}")
-             GEMINI_AVAILABLE = False
-
-except Exception as e:
-    print(f"Error configuring Google AI: {e}")
-    GEMINI_AVAILABLE = False
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+if not GOOGLE_API_KEY:
+    print("Warning: GOOGLE_API_KEY environment variable not set. Gemini API will not be available.")
+# Assumed to work until check_dependencies() finds out otherwise, so importing never touches the network
+GEMINI_AVAILABLE = bool(GOOGLE_API_KEY)
 
 
 # Initialize FastAPI app
@@ -79,6 +77,81 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    await job_queue.start()
+
+
+background_tasks = set()
+
+
+@app.on_event("startup")
+async def start_background_checks():
+    # Neither step blocks startup: the server accepts requests while they run
+    if WARM_UP_IMPORTS:
+        warm_up_in_background()
+    background_tasks.add(asyncio.ensure_future(check_dependencies()))
+
+
+async def check_dependencies():
+    """Verify the Gemini API key and create the Twilio client, off the import path."""
+    global GEMINI_AVAILABLE
+    if GEMINI_AVAILABLE:
+        try:
+            # Fetch the model to verify API key works
+            await gemini_client.check_model()
+            print("Google AI (Gemini) configured successfully.")
+        except GeminiKeyError as api_err:
+            print(f"Warning: Google AI API key might be invalid or configuration failed: {api_err}")
+            GEMINI_AVAILABLE = False
+        except Exception as api_err:
+            # A network problem or a passing error (rate limit, timeout) now says nothing about later
+            # calls; the circuit breaker covers those
+            print(f"Warning: could not check the API key with Google AI, will keep trying per call: {error_text(api_err)}")
+    if TWILIO_AVAILABLE:
+        try:
+            await asyncio.to_thread(get_twilio_client)
+            print("Twilio client configured successfully.")
+        except Exception as e:
+            print(f"Warning: could not create the Twilio client: {e}")
+
+
+def get_twilio_client():
+    global twilio_client
+    with _twilio_lock:
+        if twilio_client is None:
+            twilio_client = twilio_rest.Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        return twilio_client
+
+
+def send_sms(**kwargs):
+    return get_twilio_client().messages.create(**kwargs)
+
+
+@app.on_event("shutdown")
+async def stop_worker_pools():
+    for task in background_tasks:
+        task.cancel()
+    await job_queue.stop()
+    shutdown_executors()
+    sandbox_pool.shutdown()
+    await gemini_client.aclose()
+
+
+async def cancel_on_disconnect(request, coro, poll_interval=0.5):
+    """Await `coro`, cancelling it (and any Gemini call it is waiting on) if the client goes away."""
+    task = asyncio.ensure_future(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=poll_interval)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            raise HTTPException(status_code=499, detail="Client disconnected")
 
 # Request models (keep as is)
 class ImagePayload(BaseModel):
@@ -89,26 +162,65 @@ class MathExpressionPayload(BaseModel):
     expression: str
     format: str = "latex"
 
+class BatchExplainPayload(BaseModel):
+    items: List[MathExpressionPayload]
+
 # Response models (keep as is)
+class OCRLine(BaseModel):
+    text: str
+    confidence: Optional[float] = None
+
+class OCRRegion(BaseModel):
+    text: str
+    confidence: Optional[float] = None
+
 class OCRResponse(BaseModel):
     result: str
     confidence: Optional[float] = None
+    lines: List[OCRLine] = []
+    regions: List[OCRRegion] = []
 
 class ExplainResponse(BaseModel):
     original: str
     explanation: str
 
+class BatchExplainItem(BaseModel):
+    original: str
+    explanation: Optional[str] = None
+    success: bool = True
+    error: Optional[str] = None
+
+class BatchExplainResponse(BaseModel):
+    results: List[BatchExplainItem]
+
+class PDFOCRPage(BaseModel):
+    page: int
+    confidence: Optional[float] = None
+
 class PDFResponse(BaseModel):
     content: str
     pages: int
+    ocr_pages: List[PDFOCRPage] = []
 
 class MathImageResponse(BaseModel):
     explanation: str
     latex: Optional[str] = None
     confidence: Optional[float] = None
+    engine: Optional[str] = None  # "gemini" or "ocr"
     success: bool = True
     error: Optional[str] = None
 
+class JobResponse(BaseModel):
+    id: str
+    kind: str  # "ocr", "pdf", "math-image" or "plot-image"
+    status: str  # "queued", "running", "done", "failed" or "cancelled"
+    progress: dict = {}
+    result: Optional[dict] = None  # The body the matching synchronous endpoint would have returned
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+    expires_at: float
+
 # Help request model
 class HelpRequest(BaseModel):
     user_name: Optional[str] = "User"
@@ -121,204 +233,90 @@ class HelpResponse(BaseModel):
     success: bool
     message: str
 
-# Helper functions (ocr_image, extract_pdf_text, explain_math_expression, explain_sympy_expression, rule_based_explanation remain largely the same)
+# Helper functions (OCR lives in app/ocr.py, PDF extraction in app/pdf.py, math explanations in app/math_explain.py)
 
-def ocr_image(image_data):
-    """Process an image with Tesseract OCR."""
-    try:
-        img = Image.open(io.BytesIO(image_data))
+async def read_upload(file, limit=UPLOAD_MAX_BYTES, image=False):
+    """Stream an uploaded file into an Upload (app/uploads.py), timing it as the request's decode step.
 
-        # Preprocess the image for better OCR
-        # Convert to grayscale
-        if img.mode != 'L':
-            img = img.convert('L')
+    With `image=True`, an image over the pixel budget is rejected from its header alone (app/images.py).
+    """
+    with metrics.timed_step("decode"):
+        upload = await ingest(file, limit)
+        if image:
+            check_image(upload)
+        return upload
+
+def gemini_outcome(error):
+    """Label for the Gemini call counter."""
+    if error is None:
+        return "ok"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, StageOverloaded):
+        return "overloaded"
+    return "error"
+
+# Bump OCR_RESULT_VERSION whenever the shape of ocr_image_lines results changes so cached ones are not reused.
+# The language, preprocessing and layout settings change what a page reads as, so they are part of it too.
+OCR_PREPROCESS_VERSION = (
+    "".join("1" if step else "0" for step in (OCR_DOWNSCALE, OCR_DESKEW, OCR_THRESHOLD, OCR_AUTOCROP))
+    + f"-{OCR_TARGET_LINE_HEIGHT}-{OCR_MAX_PIXELS}-{OCR_DESKEW_MAX_ANGLE}"
+)
+OCR_LAYOUT_VERSION = (f"layout{OCR_REGION_WORKERS}-{OCR_LAYOUT_MIN_PIXELS}"
+                      if OCR_LAYOUT and OCR_REGION_WORKERS >= 2 else "whole")
+OCR_RESULT_VERSION = f"3-{OCR_LANG}-{OCR_PREPROCESS_VERSION}-{OCR_LAYOUT_VERSION}"
 
-        # Extract text using Tesseract
-        text = pytesseract.image_to_string(img)
+async def ocr_image_cached(image_data):
+    """Run ocr_image_lines in the OCR pool, reusing the result for identical image bytes.
 
-        # Calculate confidence if possible
-        confidence = None
+    A large page is split into regions, which are read in parallel on the pool workers idle when it starts.
+    """
+    text, confidence, lines, regions = await cached(
+        "ocr", image_data,
+        lambda: run_stage_wide("ocr", ocr_image_lines, OCR_REGION_WORKERS, image_data),
+        version=OCR_RESULT_VERSION,
+    )
+    return text, confidence, lines, regions
+
+async def gemini_image(image_data):
+    """The inline image part for a Gemini call, built in the image stage so decoding, re-encoding and
+    base64 never run on the event loop. The image is shrunk first; if that fails it goes as uploaded."""
+    payload = image_data
+    if GEMINI_IMAGE_SHRINK:
         try:
-            data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
-            if 'conf' in data:
-                # Calculate average confidence excluding -1 values
-                conf_values = [float(c) for c in data['conf'] if c != -1]
-                if conf_values:
-                    confidence = sum(conf_values) / len(conf_values)
-        except Exception: # Catch specific pytesseract errors if known
-            pass
-
-        return text.strip(), confidence
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OCR processing error: {str(e)}")
-
-def extract_pdf_text(pdf_data):
-    """Extract text from a PDF file."""
-    try:
-        # Open the PDF from binary data - using a dummy filename
-        doc = fitz.open(stream=pdf_data, filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text()
-
-        return {
-            "content": text,
-            "pages": len(doc)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"PDF processing error: {str(e)}")
-
-def explain_math_expression(expression, format_type="latex"):
-    """Explain a math expression in plain English using SymPy or rules."""
-    try:
-        # Remove LaTeX formatting if present
-        if format_type == "latex":
-            # Common LaTeX replacements (keep as is)
-            replacements = {
-                r"\frac": "/", r"\cdot": "*", r"\times": "*", r"\div": "/",
-                r"\sqrt": "sqrt", r"\pi": "pi", r"\alpha": "alpha", r"\beta": "beta",
-                r"\sum": "sum", r"\int": "integral", r"\infty": "oo", r"\sin": "sin",
-                r"\cos": "cos", r"\tan": "tan", r"\log": "log", r"\ln": "ln",
-                r"\exp": "exp", r"^": "**", r"_": "", r"{": "", r"}": "",
-                r"\left": "", r"\right": "", r"\lim": "limit",
-            }
-            clean_expr = expression
-            for latex, replacement in replacements.items():
-                clean_expr = clean_expr.replace(latex, replacement)
-
-            # Try to parse with SymPy, with implicit multiplication
-            transformations = standard_transformations + (implicit_multiplication,)
-            try:
-                sympy_expr = parse_expr(clean_expr, transformations=transformations)
-                explanation = explain_sympy_expression(sympy_expr)
-                return {
-                    "original": expression,
-                    "explanation": explanation
-                }
-            except Exception as parse_error:
-                # Fall back to rule-based explanation if SymPy fails
-                print(f"SymPy parsing failed for '{clean_expr}' (from LaTeX '{expression}'): {parse_error}")
-                return {
-                    "original": expression,
-                    "explanation": rule_based_explanation(clean_expr)
-                }
-        else:
-            # Assume plain math expression format
-            transformations = standard_transformations + (implicit_multiplication,)
-            sympy_expr = parse_expr(expression, transformations=transformations)
-            explanation = explain_sympy_expression(sympy_expr)
-
-            return {
-                "original": expression,
-                "explanation": explanation
-            }
-    except Exception as e:
-        # Catch potential errors during parsing or explanation itself
-        print(f"Error explaining math expression '{expression}': {e}")
-        # Provide a fallback explanation if SymPy or rule-based fails
-        return {
-            "original": expression,
-            "explanation": f"Could not generate a detailed explanation for: {expression}. Error: {e}"
-        }
-
-
-def explain_sympy_expression(expr):
-    """Generate an explanation from a SymPy expression."""
-    explanation = ""
-    try:
-        if isinstance(expr, sympy.Add):
-            terms = [str(arg) for arg in expr.args]
-            explanation = f"This is an addition of the terms: {', '.join(terms)}"
-        elif isinstance(expr, sympy.Mul):
-            factors = [str(arg) for arg in expr.args]
-            explanation = f"This is a multiplication of the factors: {', '.join(factors)}"
-        elif isinstance(expr, sympy.Pow):
-            base, exp = expr.args
-            explanation = f"This represents {base} raised to the power of {exp}"
-        elif isinstance(expr, sympy.Function):
-            name = type(expr).__name__
-            args = ", ".join([str(arg) for arg in expr.args])
-            explanation = f"This is the {name} function applied to {args}"
-        elif isinstance(expr, sympy.Equality):
-            left, right = expr.args
-            explanation = f"This is an equation stating that {left} equals {right}"
-        # Add more specific cases as needed (e.g., Integral, Sum, Limit)
-        elif isinstance(expr, sympy.Integral):
-             func, (var, *bounds) = expr.args
-             bound_str = f" from {bounds[0]} to {bounds[1]}" if bounds else ""
-             explanation = f"This is the integral of {func} with respect to {var}{bound_str}"
-        elif isinstance(expr, sympy.Sum):
-             func, (var, lower, upper) = expr.args
-             explanation = f"This is the summation of {func} for {var} from {lower} to {upper}"
-        elif isinstance(expr, sympy.Limit):
-            func, var, point, direction = expr.args
-            dir_str = f" from the {direction} direction" if direction != '+' else ""
-            explanation = f"This is the limit of {func} as {var} approaches {point}{dir_str}"
-        else:
-            explanation = f"This is a mathematical expression: {expr}"
-            try:
-                # Check if it's numeric before evaluating
-                if expr.is_number:
-                    value = float(expr.evalf())
-                    explanation += f". It evaluates to approximately {value:.4f}"
-            except (AttributeError, TypeError, ValueError):
-                 # Handle cases where evalf() fails or is not applicable
-                 pass
-    except Exception as e:
-        print(f"Error explaining SymPy expression '{expr}': {e}")
-        explanation = f"Could not fully explain the expression: {expr}"
-
-    return explanation
-
-def rule_based_explanation(expr_str):
-    """Fallback rule-based explanation when SymPy parsing fails."""
-    explanation = "This expression "
-    ops = []
-    if "+" in expr_str: ops.append("addition")
-    if "-" in expr_str: ops.append("subtraction")
-    if "*" in expr_str: ops.append("multiplication")
-    if "/" in expr_str: ops.append("division")
-    if "**" in expr_str or "^" in expr_str: ops.append("exponentiation")
-    if "sqrt" in expr_str: ops.append("square roots")
-    if any(trig in expr_str for trig in ["sin", "cos", "tan"]): ops.append("trigonometric functions")
-    if any(func in expr_str for func in ["log", "ln", "exp"]): ops.append("logarithmic or exponential functions")
-    if "sum" in expr_str: ops.append("summation")
-    if "int" in expr_str: ops.append("integration")
-    if "lim" in expr_str: ops.append("limits")
-
-    if ops:
-        explanation += "involves " + ", ".join(ops) + "."
-    else:
-        explanation += f"is '{expr_str}'. A detailed automated explanation could not be generated."
-
-    return explanation
-
-
-def call_gemini_vision_api(image_data, prompt):
+            with metrics.timed_step("gemini_payload"):
+                shrunk = await run_stage("image", shrink_image, image_data)
+        except Exception as e:
+            print(f"Could not shrink image for Gemini, sending it as uploaded: {e}")
+            shrunk = None
+        if shrunk is not None:  # None: already as small as it gets
+            saved = len(image_data) - len(shrunk)
+            print(f"Gemini image payload: {len(image_data)} -> {len(shrunk)} bytes "
+                  f"({saved} saved, {saved / max(1, len(image_data)):.0%})")
+            payload = shrunk
+    return await run_stage("image", image_part, payload)
+
+async def call_gemini_vision_api(image_data, prompt):
     """Helper function to call the Gemini Vision API."""
     if not GEMINI_AVAILABLE:
         raise ConnectionError("Gemini API is not available (check API key and configuration).")
 
     try:
-        img = Image.open(io.BytesIO(image_data))
-        model = genai.GenerativeModel('gemini-1.5-flash')  # Updated model name
-        response = model.generate_content([prompt, img], stream=False)
-        # Handle potential safety blocks or empty responses
-        if not response.parts:
-            # Check candidate for blocked prompt/finish reason
-            try:
-                finish_reason = response.prompt_feedback.block_reason
-                if finish_reason:
-                    return f"Request blocked due to: {finish_reason}. Explanation could not be generated."
-            except Exception:
-                pass # No block reason found, might be other issue
-            return "Gemini returned an empty response. Could not generate explanation."
-
-        return response.text # Access the generated text content
+        # The breaker fails fast while Gemini is unhealthy (before the image is shrunk for a call
+        # that would not go out); the gemini stage caps in-flight calls.
+        # Blocked and empty responses come back as readable text.
+        gemini_breaker.check()
+        part = await gemini_image(image_data)
+        with metrics.timed_step("gemini_call"):
+            async with gemini_breaker.guard(ignore=(StageOverloaded,)):
+                response = await STAGES["gemini"].run_async(gemini_client.model().generate_content, prompt, part)
+        metrics.GEMINI_CALLS.inc(endpoint=metrics.current_endpoint.get(), outcome="ok")
+        return response
     except Exception as e:
-        print(f"Error calling Gemini Vision API: {e}")
+        metrics.GEMINI_CALLS.inc(endpoint=metrics.current_endpoint.get(), outcome=gemini_outcome(e))
+        print(f"Error calling Gemini Vision API: {error_text(e)}")
         # Re-raise a more specific error or return None/error indicator
-        raise RuntimeError(f"Gemini API call failed: {e}")
+        raise RuntimeError(f"Gemini API call failed: {error_text(e)}")
 
 
 def extract_latex(text):
@@ -347,51 +345,80 @@ def extract_latex(text):
     return None
 
 
+# Gemini prompts. Bump PROMPT_VERSION whenever a prompt changes so cached results are not reused.
+PROMPT_VERSION = "1"
+MATH_EQUATION_PROMPT = (
+    "Analyze the image containing a mathematical equation or expression. "
+    "Provide a clear, step-by-step explanation of what the equation represents, "
+    "its components (variables, constants, operators), and its purpose or meaning. "
+    "If possible, also provide the equation in standard LaTeX format, clearly marked (e.g., start with 'LaTeX:'). "
+    "Describe it as if explaining to someone who cannot see the image."
+)
+
+MATH_PLOT_PROMPT = (
+    "Analyze the image containing a mathematical plot or graph. Describe it in detail: "
+    "1. What type of plot is it (e.g., line graph, bar chart, scatter plot, function plot)? "
+    "2. What do the axes represent (including labels and units, if visible)? "
+    "3. What is the general trend or pattern shown (e.g., increasing, decreasing, cyclical, correlation)? "
+    "4. Are there any key features like intercepts, peaks, troughs, asymptotes, outliers, or specific data points? "
+    "5. What is the overall message or conclusion that can be drawn from this visualization? "
+    "Explain clearly for someone who cannot see the image."
+)
+
+
 # --- Updated function to process math images ---
-def process_math_equation(image_data):
+async def process_math_equation(image_data):
     """Process an image containing mathematical equations using Gemini or OCR fallback."""
-    explanation = "Processing failed."
-    latex_result = None
     use_gemini = GEMINI_AVAILABLE # Check if API key is set and configured
 
     print(f"Starting process_math_equation. Gemini available: {use_gemini}")
 
+    if use_gemini and HEDGE_ENABLED:
+        return await hedged_analysis(image_data, gemini_math_equation, ocr_math_equation)
+
     if use_gemini:
         try:
-            prompt = (
-                "Analyze the image containing a mathematical equation or expression. "
-                "Provide a clear, step-by-step explanation of what the equation represents, "
-                "its components (variables, constants, operators), and its purpose or meaning. "
-                "If possible, also provide the equation in standard LaTeX format, clearly marked (e.g., start with 'LaTeX:'). "
-                "Describe it as if explaining to someone who cannot see the image."
-            )
-            print(f"Calling Gemini with prompt: '{prompt[:50]}...'") # Print the beginning of the prompt
-            gemini_response = call_gemini_vision_api(image_data, prompt)
-            print(f"Gemini response received: '{gemini_response[:100]}...'") # Print the beginning of the response
-            explanation = gemini_response
-            latex_result = extract_latex(gemini_response) # Try to get LaTeX
-            print(f"Extracted LaTeX: '{latex_result}'")
-            # Remove the extracted LaTeX part from the main explanation for clarity
-            if latex_result and f"LaTeX: {latex_result}" in explanation:
-                explanation = explanation.replace(f"LaTeX: {latex_result}", "").strip()
-            elif latex_result and f"${latex_result}$" in explanation:
-                explanation = explanation.replace(f"${latex_result}$", "").strip()
-            elif latex_result and f"$$ {latex_result} $$" in explanation: # Corrected typo: added space
-                explanation = explanation.replace(f"$$ {latex_result} $$", "").strip()
-
-            print("Processed math equation using Gemini.")
-            return {
-                "explanation": explanation,
-                "latex": latex_result
-            }
-
+            return await gemini_math_equation(image_data)
         except Exception as gemini_err:
             print(f"Gemini processing failed for math equation: {gemini_err}. Falling back to OCR.")
 
-    # OCR-based processing (fallback)
+    return await ocr_math_equation(image_data)
+
+
+async def gemini_math_equation(image_data):
+    prompt = MATH_EQUATION_PROMPT
+    print(f"Calling Gemini with prompt: '{prompt[:50]}...'") # Print the beginning of the prompt
+    gemini_response = await call_gemini_vision_api(image_data, prompt)
+    print(f"Gemini response received: '{gemini_response[:100]}...'") # Print the beginning of the response
+    return gemini_equation_result(gemini_response)
+
+
+def gemini_equation_result(gemini_response):
+    """Split Gemini's answer for an equation image into the explanation and its LaTeX."""
+    explanation = gemini_response
+    latex_result = extract_latex(gemini_response) # Try to get LaTeX
+    print(f"Extracted LaTeX: '{latex_result}'")
+    # Remove the extracted LaTeX part from the main explanation for clarity
+    if latex_result and f"LaTeX: {latex_result}" in explanation:
+        explanation = explanation.replace(f"LaTeX: {latex_result}", "").strip()
+    elif latex_result and f"${latex_result}$" in explanation:
+        explanation = explanation.replace(f"${latex_result}$", "").strip()
+    elif latex_result and f"$$ {latex_result} $$" in explanation: # Corrected typo: added space
+        explanation = explanation.replace(f"$$ {latex_result} $$", "").strip()
+
+    print("Processed math equation using Gemini.")
+    return {
+        "explanation": explanation,
+        "latex": latex_result,
+        "engine": "gemini"
+    }
+
+
+async def ocr_math_equation(image_data):
+    """OCR-based processing of a math equation image (used when Gemini is unavailable or fails)."""
     print("Using OCR fallback for math equation.")
     try:
-        text, confidence = ocr_image(image_data)
+        text, confidence, _, _ = await ocr_image_cached(image_data)
         print(f"OCR detected text: '{text}' with confidence: {confidence}")
         if not text:
             explanation = "OCR could not detect any text in the image."
@@ -401,57 +428,64 @@ def process_math_equation(image_data):
             latex_result = extract_latex(text)
             print(f"Extracted LaTeX from OCR: '{latex_result}'")
             if latex_result:
-                explanation_result = explain_math_expression(latex_result, format_type="latex")
+                explanation_result = await run_stage("sympy", explain_math_expression, latex_result, format_type="latex")
                 explanation = f"LaTeX detected: '{latex_result}'.\nExplanation: {explanation_result['explanation']}"
             else:
                 # If no LaTeX found, try explaining the raw OCR text (less reliable)
-                explanation_result = explain_math_expression(text, format_type="plain")
+                explanation_result = await run_stage("sympy", explain_math_expression, text, format_type="plain")
                 explanation = f"OCR detected text: '{text}'.\nExplanation: {explanation_result['explanation']}"
 
         return {
             "explanation": explanation,
             "latex": latex_result,
+            "engine": "ocr",
             # "confidence": confidence / 100.0 if confidence is not None else None
         }
 
+    except StageOverloaded:
+        raise
     except Exception as ocr_err:
         print(f"OCR processing also failed for math equation: {ocr_err}")
         raise HTTPException(status_code=500, detail=f"Math equation processing error (Gemini unavailable/failed, OCR failed): {ocr_err}")
 
 
 # --- Updated function to process math plots ---
-def process_math_plot(image_data):
+async def process_math_plot(image_data):
     """Process an image containing mathematical plots/graphs using Gemini or OCR fallback."""
-    explanation = "Processing failed."
     use_gemini = GEMINI_AVAILABLE
 
+    if use_gemini and HEDGE_ENABLED:
+        return await hedged_analysis(image_data, gemini_math_plot, ocr_math_plot)
+
     if use_gemini:
         try:
-            prompt = (
-                "Analyze the image containing a mathematical plot or graph. Describe it in detail: "
-                "1. What type of plot is it (e.g., line graph, bar chart, scatter plot, function plot)? "
-                "2. What do the axes represent (including labels and units, if visible)? "
-                "3. What is the general trend or pattern shown (e.g., increasing, decreasing, cyclical, correlation)? "
-                "4. Are there any key features like intercepts, peaks, troughs, asymptotes, outliers, or specific data points? "
-                "5. What is the overall message or conclusion that can be drawn from this visualization? "
-                "Explain clearly for someone who cannot see the image."
-            )
-            gemini_response = call_gemini_vision_api(image_data, prompt)
-            explanation = gemini_response
-            print("Processed math plot using Gemini.")
-            return {
-                "explanation": explanation,
-                "latex": None # Plots don't usually have a single LaTeX representation
-            }
-
+            return await gemini_math_plot(image_data)
         except Exception as gemini_err:
             print(f"Gemini processing failed for math plot: {gemini_err}. Falling back to OCR description.")
              # Fall through to OCR if Gemini fails
 
-    # OCR-based processing (fallback description)
+    return await ocr_math_plot(image_data)
+
+
+async def gemini_math_plot(image_data):
+    gemini_response = await call_gemini_vision_api(image_data, MATH_PLOT_PROMPT)
+    return gemini_plot_result(gemini_response)
+
+
+def gemini_plot_result(gemini_response):
+    print("Processed math plot using Gemini.")
+    return {
+        "explanation": gemini_response,
+        "latex": None, # Plots don't usually have a single LaTeX representation
+        "engine": "gemini"
+    }
+
+
+async def ocr_math_plot(image_data):
+    """OCR-based description of a plot image (used when Gemini is unavailable or fails)."""
     print("Using OCR fallback for math plot description.")
     try:
-        text, confidence = ocr_image(image_data)
+        text, confidence, _, _ = await ocr_image_cached(image_data)
         explanation = "Analyzed using basic OCR (AI description unavailable).\n"
         explanation += "This appears to be a mathematical plot or graph. "
 
@@ -476,20 +510,304 @@ def process_math_plot(image_data):
         return {
             "explanation": explanation,
             "latex": None,
+            "engine": "ocr",
             # "confidence": confidence / 100.0 if confidence is not None else None
         }
 
+    except StageOverloaded:
+        raise
     except Exception as ocr_err:
         print(f"OCR processing also failed for math plot: {ocr_err}")
         raise HTTPException(status_code=500, detail=f"Math plot processing error (Gemini unavailable/failed, OCR failed): {ocr_err}")
 
 
+async def hedged_analysis(image_data, gemini_call, ocr_call):
+    """Race Gemini against local OCR so a slow or failing Gemini call can't blow the latency budget.
+
+    Gemini starts immediately and OCR after HEDGE_DELAY seconds (unless Gemini has already
+    answered). Gemini's answer is preferred whenever it arrives within HEDGE_DEADLINE seconds;
+    after the deadline whichever engine has a result wins. The losing task is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + HEDGE_DEADLINE
+    gemini_task = asyncio.ensure_future(gemini_call(image_data))
+    ocr_task = None
+    try:
+        await asyncio.wait({gemini_task}, timeout=HEDGE_DELAY)
+        if gemini_task.done() and gemini_task.exception() is None:
+            return gemini_task.result()
+        if gemini_task.done():
+            print(f"Gemini failed ({gemini_task.exception()}). Using OCR result.")
+            return await ocr_call(image_data)
+
+        print(f"Gemini has not answered after {HEDGE_DELAY}s, starting OCR in parallel.")
+        ocr_task = asyncio.ensure_future(ocr_call(image_data))
+
+        # Until the deadline only a Gemini answer ends the wait (or a Gemini failure)
+        await asyncio.wait({gemini_task}, timeout=max(0.0, deadline - loop.time()))
+        if gemini_task.done() and gemini_task.exception() is None:
+            return gemini_task.result()
+        if not gemini_task.done():
+            print(f"Gemini missed the {HEDGE_DEADLINE}s deadline.")
+
+        # Past the deadline (or Gemini failed): take the first successful result
+        while True:
+            for task in (gemini_task, ocr_task):
+                if task.done() and task.exception() is None:
+                    return task.result()
+            running = [task for task in (gemini_task, ocr_task) if not task.done()]
+            if not running:
+                return await ocr_task  # Both failed: re-raise the OCR error like the non-hedged path
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (gemini_task, ocr_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+def sse_event(event, payload):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def stream_image_analysis(image_data, mode, prompt, to_result, ocr_fallback):
+    """Server-sent events for an image analysis: Gemini's text as it is generated, then the result.
+
+    Sends `chunk` events ({"text": ...}) followed by one `done` event carrying the same fields as the
+    non-streaming endpoint (explanation, latex, engine). If Gemini is unavailable or fails before its
+    first chunk, the OCR fallback result is sent as a single chunk instead.
+    """
+    key = cache_key(image_data, mode, analysis_version())
+    result = result_cache.get(key) if result_cache is not None else None
+    if result is not None:
+        yield sse_event("chunk", {"text": result["explanation"]})
+        yield sse_event("done", result)
+        return
+
+    chunks = []
+    if GEMINI_AVAILABLE:
+        try:
+            gemini_breaker.check()  # Don't shrink the image for a call the open circuit would reject
+            part = await gemini_image(image_data)
+            with metrics.timed_step("gemini_call"):
+                async with gemini_breaker.guard(ignore=(StageOverloaded,)) as call, STAGES["gemini"].slot():
+                    async for text in gemini_client.model().stream_content(prompt, part):
+                        if not chunks:
+                            call.latency = call.elapsed()  # Judge streams by time to first chunk
+                        chunks.append(text)
+                        yield sse_event("chunk", {"text": text})
+            metrics.GEMINI_CALLS.inc(endpoint=metrics.current_endpoint.get(), outcome="ok")
+        except Exception as gemini_err:
+            metrics.GEMINI_CALLS.inc(endpoint=metrics.current_endpoint.get(), outcome=gemini_outcome(gemini_err))
+            print(f"Gemini streaming failed for {mode}: {error_text(gemini_err)}")
+            if chunks:
+                # Part of the answer was already spoken; don't switch engines mid-explanation
+                yield sse_event("error", {"error": f"Gemini API call failed: {error_text(gemini_err)}"})
+                return
+
+    try:
+        if chunks:
+            result = to_result("".join(chunks))
+        else:
+            result = await ocr_fallback(image_data)
+            yield sse_event("chunk", {"text": result["explanation"]})
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        yield sse_event("error", {"error": detail})
+        return
+
+    if result_cache is not None and should_cache_analysis(result):
+        result_cache.set(key, result)
+    yield sse_event("done", result)
+
+
+def should_cache_analysis(result):
+    """Don't pin an OCR fallback answer that was only produced because Gemini failed."""
+    return result.get("engine") == "gemini" or not GEMINI_AVAILABLE
+
+
+def analysis_version():
+    """Cache version of the image analyses: the prompts plus the engine that answers them.
+
+    With Gemini off, the stored answers are OCR fallbacks, so they must not be served once a key
+    is configured, nor after the OCR settings change; Gemini answers depend on the model.
+    """
+    engine = f"gemini-{GEMINI_MODEL}" if GEMINI_AVAILABLE else f"ocr{OCR_RESULT_VERSION}"
+    return f"{PROMPT_VERSION}-{engine}"
+
+
+# --- Job handlers ---
+# The work behind the upload endpoints. Each takes the Upload and a progress(**fields)
+# callback and returns the endpoint's JSON body; the endpoints await them directly and /jobs
+# runs them in the background.
+
+def no_progress(**fields):
+    pass
+
+
+def record_analysis(result, seconds):
+    """Count an image analysis by the engine that answered (Gemini, or the OCR fallback)."""
+    endpoint, engine = metrics.current_endpoint.get(), result.get("engine") or "unknown"
+    metrics.ANALYSES.inc(endpoint=endpoint, engine=engine)
+    metrics.ANALYSIS_SECONDS.observe(seconds, endpoint=endpoint, engine=engine)
+
+
+async def ocr_job(image_data, progress=no_progress):
+    text, confidence, lines, regions = await ocr_image_cached(image_data)
+    # Convert confidence from 0-100 (Tesseract) to 0.0-1.0 (optional, depends on how you want to present it)
+    confidence_float = confidence / 100.0 if confidence is not None else None
+    line_results = [
+        OCRLine(text=line_text, confidence=line_conf / 100.0 if line_conf is not None else None)
+        for line_text, line_conf in lines
+    ]
+    region_results = [
+        OCRRegion(text=region_text, confidence=region_conf / 100.0 if region_conf is not None else None)
+        for region_text, region_conf in regions
+    ]
+    return OCRResponse(result=text, confidence=confidence_float, lines=line_results,
+                       regions=region_results).model_dump()
+
+
+# PDF results include the OCR text of scanned pages, so they are keyed on the OCR version and settings too
+PDF_RESULT_VERSION = f"ocr{OCR_RESULT_VERSION}-{PDF_OCR_DPI if PDF_OCR_ENABLED else 'off'}"
+
+async def pdf_job(pdf_data, progress=no_progress):
+    result = await cached("pdf", pdf_data, lambda: extract_pdf_document(pdf_data, progress=progress),
+                          version=PDF_RESULT_VERSION)
+    return PDFResponse(**result).model_dump()
+
+
+async def math_image_job(contents, progress=no_progress):
+    try:
+        start = time.perf_counter()
+        result = await cached(
+            "math-image", contents, lambda: process_math_equation(contents),
+            version=analysis_version(), should_store=should_cache_analysis,
+        )
+        record_analysis(result, time.perf_counter() - start)
+        progress(engine=result.get("engine"))
+
+        # Assign confidence based on method used (heuristic)
+        confidence_score = 0.85 if result.get("engine") == "gemini" else 0.5
+        # You could refine confidence based on OCR confidence if fallback was used
+
+        return MathImageResponse(
+            explanation=result["explanation"],
+            latex=result.get("latex"), # Use .get for safety
+            confidence=confidence_score,
+            engine=result.get("engine"),
+            success=True,
+            error=None
+        ).model_dump()
+    except StageOverloaded:
+        raise
+    except Exception as e:
+        error_message = str(e)
+        error_detail = error_message
+        if DEBUG:
+            import traceback
+            error_detail = f"{error_message}\n{traceback.format_exc()}"
+            print(error_detail)
+
+        return MathImageResponse(
+            explanation="Failed to process the math image.",
+            latex=None, confidence=0.0, success=False, error=error_detail
+        ).model_dump()
+
+
+async def plot_image_job(contents, progress=no_progress):
+    try:
+        start = time.perf_counter()
+        result = await cached(
+            "plot-image", contents, lambda: process_math_plot(contents),
+            version=analysis_version(), should_store=should_cache_analysis,
+        )
+        record_analysis(result, time.perf_counter() - start)
+        progress(engine=result.get("engine"))
+
+        # Assign confidence based on method used (heuristic)
+        confidence_score = 0.8 if result.get("engine") == "gemini" else 0.4
+
+        return MathImageResponse(
+            explanation=result["explanation"],
+            latex=result.get("latex"), # Should always be None here
+            confidence=confidence_score,
+            engine=result.get("engine"),
+            success=True,
+            error=None
+        ).model_dump()
+    except StageOverloaded:
+        raise
+    except Exception as e:
+        error_message = str(e)
+        error_detail = error_message
+        if DEBUG:
+            import traceback
+            error_detail = f"{error_message}\n{traceback.format_exc()}"
+            print(error_detail)
+
+        return MathImageResponse(
+            explanation="Failed to process the plot image.",
+            latex=None, confidence=0.0, success=False, error=error_detail
+        ).model_dump()
+
+
+JOB_HANDLERS = {
+    "ocr": ocr_job,
+    "pdf": pdf_job,
+    "math-image": math_image_job,
+    "plot-image": plot_image_job,
+}
+job_queue = JobQueue(JOB_HANDLERS)
+
+
 # API Endpoints (mostly unchanged, but confidence logic updated)
 
 @app.get("/")
 async def root():
     return {"message": "STEM Assistant API is running. See /docs for API documentation."}
 
+@app.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss counters and sizes of the result cache, and how many requests were coalesced in flight."""
+    if result_cache is None:
+        return {"enabled": False, "coalescing": in_flight.snapshot()}
+    return {"enabled": True, **result_cache.snapshot(), "coalescing": in_flight.snapshot()}
+
+@app.get("/status")
+async def service_status():
+    """Health of the Gemini dependency (circuit breaker state), the load on each pipeline stage and job counts."""
+    return {
+        "gemini": {"available": GEMINI_AVAILABLE, "circuit": gemini_breaker.snapshot()},
+        "stages": {
+            name: {"running": stage.running, "waiting": stage.queue_depth, "concurrency": stage.concurrency}
+            for name, stage in STAGES.items()
+        },
+        "jobs": job_queue.snapshot(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Request, stage and step latency histograms plus current load, in the Prometheus text format.
+
+    Values are per server process; with several workers, scrape each one (or sum them).
+    """
+    for name, stage in STAGES.items():
+        metrics.STAGE_RUNNING.set(stage.running, stage=name)
+        metrics.STAGE_QUEUE_DEPTH.set(stage.queue_depth, stage=name)
+    if result_cache is not None:
+        cache = result_cache.snapshot()
+        metrics.CACHE_LOOKUPS.set(cache["hits"], result="hit")
+        metrics.CACHE_LOOKUPS.set(cache["misses"], result="miss")
+        metrics.CACHE_HIT_RATIO.set(cache["hit_rate"])
+    for mode in set(in_flight.leaders) | set(in_flight.coalesced):
+        metrics.COALESCED.set(in_flight.leaders[mode], mode=mode, role="computed")
+        metrics.COALESCED.set(in_flight.coalesced[mode], mode=mode, role="coalesced")
+    for status, count in job_queue.snapshot().items():
+        metrics.JOBS.set(count, status=status)
+    metrics.CIRCUIT_OPEN.set(0 if gemini_breaker.state == "closed" else 1)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/upload", response_model=OCRResponse)
 async def upload_image(file: UploadFile = File(None), payload: ImagePayload = None):
     """
@@ -499,19 +817,20 @@ async def upload_image(file: UploadFile = File(None), payload: ImagePayload = No
     if file and payload:
         raise HTTPException(status_code=400, detail="Provide either file upload or base64 image, not both")
     elif file:
-        image_data = await file.read()
+        image_data = await read_upload(file, image=True)
     elif payload:
         try:
-            image_data = base64.b64decode(payload.image)
+            with metrics.timed_step("decode"):
+                image_data = await asyncio.to_thread(decode_base64, payload.image)
+                check_image(image_data)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid base64 encoding: {str(e)}")
     else:
         raise HTTPException(status_code=400, detail="Provide either file upload or base64 image")
 
-    text, confidence = ocr_image(image_data)
-    # Convert confidence from 0-100 (Tesseract) to 0.0-1.0 (optional, depends on how you want to present it)
-    confidence_float = confidence / 100.0 if confidence is not None else None
-    return OCRResponse(result=text, confidence=confidence_float)
+    return await ocr_job(image_data)
 
 
 @app.post("/explain", response_model=ExplainResponse)
@@ -519,25 +838,100 @@ async def explain_expression(payload: MathExpressionPayload):
     """
     Explain a mathematical expression (LaTeX or plain text) in plain English.
     """
-    result = explain_math_expression(payload.expression, payload.format)
+    result = await run_stage("sympy", explain_math_expression, payload.expression, payload.format)
     return ExplainResponse(**result)
 
 
+@app.post("/explain/batch", response_model=BatchExplainResponse)
+async def explain_expression_batch(payload: BatchExplainPayload):
+    """
+    Explain a list of expressions in one round trip. Identical expressions are explained once,
+    distinct ones in parallel, each within EXPLAIN_ITEM_TIMEOUT seconds. Results come back in
+    input order; a failed item carries an error instead of failing the whole batch.
+    """
+    if len(payload.items) > EXPLAIN_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {EXPLAIN_BATCH_MAX_ITEMS} expressions")
+
+    # Don't let one batch fill the whole sympy queue; keep at most one slot's worth per worker in flight
+    limit = asyncio.Semaphore(STAGES["sympy"].concurrency)
+
+    async def explain_one(expression, format_type):
+        async with limit:
+            try:
+                result = await asyncio.wait_for(
+                    run_stage("sympy", explain_math_expression, expression, format_type),
+                    timeout=EXPLAIN_ITEM_TIMEOUT,
+                )
+                return BatchExplainItem(original=expression, explanation=result["explanation"])
+            except asyncio.TimeoutError:
+                error = f"Explanation timed out after {EXPLAIN_ITEM_TIMEOUT} seconds"
+            except HTTPException as e:
+                error = str(e.detail)
+            except Exception as e:
+                error = str(e)
+            return BatchExplainItem(original=expression, success=False, error=error)
+
+    unique = {}
+    for item in payload.items:
+        key = (item.expression, item.format)
+        if key not in unique:
+            unique[key] = asyncio.ensure_future(explain_one(item.expression, item.format))
+    await asyncio.gather(*unique.values())
+
+    return BatchExplainResponse(results=[unique[(item.expression, item.format)].result() for item in payload.items])
+
+
 @app.post("/pdf-upload", response_model=PDFResponse)
 async def upload_pdf(file: UploadFile = File(...)):
     """
-    Process a PDF file to extract text.
+    Process a PDF file to extract text. Scanned pages without a text layer are OCR'd
+    and listed in `ocr_pages` with their confidence.
+    """
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Uploaded file must be a PDF")
+
+    pdf_data = await read_upload(file, PDF_UPLOAD_MAX_BYTES)
+    return await pdf_job(pdf_data)
+
+
+@app.post("/pdf-upload/stream")
+async def upload_pdf_stream(file: UploadFile = File(...), format: str = "ndjson"):
+    """
+    Stream the text of a PDF page by page as it is extracted.
+
+    `format=ndjson` (default) sends one JSON object per line, `format=sse` sends server-sent events.
+    Each page is sent as {"page": n, "text": "..."}, followed by a final {"done": true, "pages": N}.
     """
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Uploaded file must be a PDF")
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+
+    pdf_data = await read_upload(file, PDF_UPLOAD_MAX_BYTES)
+    # Fail with a normal error response (500, or 503 when the pdf stage is full) before streaming starts
+    page_count = await run_stage("pdf", pdf_page_count, pdf_data)
+
+    def encode(event, payload):
+        if format == "sse":
+            return sse_event(event, payload)
+        return json.dumps(payload) + "\n"
+
+    async def generate():
+        # Pages are extracted a few at a time in the pdf stage, so streams share its limit and backpressure
+        try:
+            async for page_number, text in stream_pdf_pages(pdf_data, page_count):
+                yield encode("page", {"page": page_number, "text": text})
+            yield encode("done", {"done": True, "pages": page_count})
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else f"PDF processing error: {str(e)}"
+            yield encode("error", {"error": detail})
 
-    pdf_data = await file.read()
-    result = extract_pdf_text(pdf_data)
-    return PDFResponse(**result)
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type)
 
 
 @app.post("/process-math-image", response_model=MathImageResponse)
-async def math_equation_image(file: UploadFile = File(...)):
+async def math_equation_image(request: Request, file: UploadFile = File(...)):
     """
     Process an image containing mathematical equations using Gemini or OCR.
     """
@@ -547,37 +941,12 @@ async def math_equation_image(file: UploadFile = File(...)):
             error="Invalid file format. Please upload an image file (JPG, PNG, etc.)"
          )
 
-    try:
-        contents = await file.read()
-        result = process_math_equation(contents) # Calls the updated function
-
-        # Assign confidence based on method used (heuristic)
-        confidence_score = 0.85 if GEMINI_AVAILABLE and "OCR detected text" not in result["explanation"] else 0.5
-        # You could refine confidence based on OCR confidence if fallback was used
-
-        return MathImageResponse(
-            explanation=result["explanation"],
-            latex=result.get("latex"), # Use .get for safety
-            confidence=confidence_score,
-            success=True,
-            error=None
-        )
-    except Exception as e:
-        error_message = str(e)
-        error_detail = error_message
-        if DEBUG:
-            import traceback
-            error_detail = f"{error_message}\n{traceback.format_exc()}"
-            print(error_detail)
-
-        return MathImageResponse(
-            explanation="Failed to process the math image.",
-            latex=None, confidence=0.0, success=False, error=error_detail
-        )
+    contents = await read_upload(file, image=True)
+    return await cancel_on_disconnect(request, math_image_job(contents))
 
 
 @app.post("/process-plot-image", response_model=MathImageResponse)
-async def math_plot_image(file: UploadFile = File(...)):
+async def math_plot_image(request: Request, file: UploadFile = File(...)):
     """
     Process an image containing mathematical plots/graphs using Gemini or OCR.
     """
@@ -587,32 +956,91 @@ async def math_plot_image(file: UploadFile = File(...)):
              error="Invalid file format. Please upload an image file (JPG, PNG, etc.)"
          )
 
-    try:
-        contents = await file.read()
-        result = process_math_plot(contents) # Calls the updated function
+    contents = await read_upload(file, image=True)
+    return await cancel_on_disconnect(request, plot_image_job(contents))
 
-        # Assign confidence based on method used (heuristic)
-        confidence_score = 0.8 if GEMINI_AVAILABLE and "Analyzed using basic OCR" not in result["explanation"] else 0.4
+@app.post("/process-math-image/stream")
+async def math_equation_image_stream(file: UploadFile = File(...)):
+    """
+    Like /process-math-image, but streams the explanation as server-sent events while Gemini
+    generates it. The extracted LaTeX arrives in the final `done` event.
+    """
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="Invalid file format. Please upload an image file (JPG, PNG, etc.)")
 
-        return MathImageResponse(
-            explanation=result["explanation"],
-            latex=result.get("latex"), # Should always be None here
-            confidence=confidence_score,
-            success=True,
-            error=None
-        )
-    except Exception as e:
-        error_message = str(e)
-        error_detail = error_message
-        if DEBUG:
-            import traceback
-            error_detail = f"{error_message}\n{traceback.format_exc()}"
-            print(error_detail)
+    contents = await read_upload(file, image=True)
+    events = stream_image_analysis(contents, "math-image", MATH_EQUATION_PROMPT, gemini_equation_result, ocr_math_equation)
+    return StreamingResponse(events, media_type="text/event-stream")
+
+
+@app.post("/process-plot-image/stream")
+async def math_plot_image_stream(file: UploadFile = File(...)):
+    """
+    Like /process-plot-image, but streams the description as server-sent events while Gemini
+    generates it.
+    """
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="Invalid file format. Please upload an image file (JPG, PNG, etc.)")
+
+    contents = await read_upload(file, image=True)
+    events = stream_image_analysis(contents, "plot-image", MATH_PLOT_PROMPT, gemini_plot_result, ocr_math_plot)
+    return StreamingResponse(events, media_type="text/event-stream")
+
+
+@app.post("/jobs/{kind}", response_model=JobResponse, status_code=202)
+async def submit_job(kind: str, file: UploadFile = File(...)):
+    """
+    Queue an upload for background processing and return its job right away. `kind` is
+    "ocr", "pdf", "math-image" or "plot-image"; the job's result is the body the matching
+    endpoint (/upload, /pdf-upload, /process-math-image, /process-plot-image) would return.
+    """
+    if kind not in JOB_HANDLERS:
+        raise HTTPException(status_code=404, detail=f"Unknown job kind '{kind}'. Use one of: {', '.join(JOB_HANDLERS)}")
+    if kind == "pdf" and not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Uploaded file must be a PDF")
+    if kind != "pdf" and not (file.content_type or "").startswith('image/'):
+        raise HTTPException(status_code=400, detail="Invalid file format. Please upload an image file (JPG, PNG, etc.)")
+
+    if kind == "pdf":
+        upload = await read_upload(file, PDF_UPLOAD_MAX_BYTES)
+    else:
+        upload = await read_upload(file, image=True)
+    return await job_queue.submit(kind, upload)
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Status, progress and (once done) result of a job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (it may have expired)")
+    return job
+
+
+@app.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job. Finished jobs are left as they are."""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (it may have expired)")
+    return job
+
+
+@app.websocket("/jobs/{job_id}/ws")
+async def watch_job(websocket: WebSocket, job_id: str):
+    """Send the job as JSON every time it changes; the socket is closed once the job has finished."""
+    await websocket.accept()
+    try:
+        sent = False
+        async for job in job_queue.watch(job_id):
+            await websocket.send_json(JobResponse(**job).model_dump())
+            sent = True
+        if not sent:
+            await websocket.send_json({"error": "Job not found (it may have expired)"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
 
-        return MathImageResponse(
-            explanation="Failed to process the plot image.",
-            latex=None, confidence=0.0, success=False, error=error_detail
-        )
 
 @app.post("/send-help-sms", response_model=HelpResponse)
 async def send_help_sms(request: HelpRequest):
@@ -654,7 +1082,8 @@ async def send_help_sms(request: HelpRequest):
             )
         
         # Send the SMS
-        message = twilio_client.messages.create(
+        message = await run_stage(
+            "twilio", send_sms,
             body=message_body,
             from_=TWILIO_PHONE_NUMBER,
             to=RECIPIENT_PHONE_NUMBER
@@ -664,6 +1093,8 @@ async def send_help_sms(request: HelpRequest):
             success=True,
             message=f"Help request sent successfully. Reference ID: {message.sid}"
         )
+    except StageOverloaded:
+        raise
     except Exception as e:
         error_msg = f"Error sending SMS: {str(e)}"
         error_details = str(e)
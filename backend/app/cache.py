@@ -0,0 +1,202 @@
+# /app/cache.py
+# Content-addressed cache for endpoint results. Keys are a hash of the upload's digest plus the
+# processing mode and prompt version, so repeat uploads of the same worksheet skip OCR, Gemini
+# and PyMuPDF entirely. Values must be JSON-serializable.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import (
+    CACHE_ENABLED, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL_SECONDS, CACHE_DIR, CACHE_DISK_MAX_BYTES,
+)
+from app.singleflight import in_flight
+from app.uploads import as_upload
+
+
+def cache_key(data, mode, version=""):
+    """Hash the upload (bytes or an Upload, whose digest was taken while it streamed in) together
+    with what is being done to it."""
+    digest = hashlib.sha256()
+    digest.update(f"{mode}\0{version}\0".encode("utf-8"))
+    digest.update(as_upload(data).digest)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache: a size-bounded in-memory LRU in front of an optional on-disk store.
+
+    Both tiers expire entries after `ttl` seconds and evict least recently used entries
+    when they exceed their byte budget.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS,
+                 disk_dir=CACHE_DIR, disk_max_bytes=CACHE_DISK_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory = OrderedDict()  # key -> (expires_at, size, value)
+        self._memory_bytes = 0
+        self._disk_index = OrderedDict()  # key -> size, oldest first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    # --- Public API ---
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, size, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return value
+                self._drop_memory(key)
+
+            value = self._disk_get(key, now)
+            if value is not None:
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                self._memory_set(key, value, len(json.dumps(value)), now)
+                return value
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self.stats["sets"] += 1
+            self._memory_set(key, value, len(payload), now)
+            if self.disk_dir:
+                self._disk_set(key, payload)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # --- Memory tier ---
+
+    def _memory_set(self, key, value, size, now):
+        if size > self.max_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (now + self.ttl, size, value)
+        self._memory_bytes += size
+        while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self.stats["evictions"] += 1
+
+    def _drop_memory(self, key):
+        _, size, _ = self._memory.pop(key)
+        self._memory_bytes -= size
+
+    # --- Disk tier ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _load_disk_index(self):
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir or key not in self._disk_index:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= now:
+                self._drop_disk(key)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self._drop_disk(key)
+            return None
+        self._disk_index.move_to_end(key)
+        return value
+
+    def _disk_set(self, key, payload):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write cache entry to disk: {e}")
+            return
+        if key in self._disk_index:
+            self._disk_bytes -= self._disk_index.pop(key)
+        size = len(payload.encode("utf-8"))
+        self._disk_index[key] = size
+        self._disk_bytes += size
+        while self._disk_bytes > self.disk_max_bytes and self._disk_index:
+            self._drop_disk(next(iter(self._disk_index)))
+            self.stats["evictions"] += 1
+
+    def _drop_disk(self, key):
+        size = self._disk_index.pop(key, 0)
+        self._disk_bytes -= size
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+
+result_cache = ResultCache() if CACHE_ENABLED else None
+
+
+async def cached(mode, data, compute, version="", should_store=None):
+    """Return the cached result for (data, mode, version) or await compute() and store it.
+
+    Concurrent misses for the same key share a single compute() call (see app/singleflight.py).
+    `should_store(result)` can veto caching of results that should not be pinned
+    (e.g. a fallback answer produced during a transient outage).
+    """
+    key = cache_key(data, mode, version)
+    if result_cache is not None:
+        result = result_cache.get(key)
+        if result is not None:
+            return result
+
+    async def compute_and_store():
+        result = await compute()
+        if result_cache is not None and (should_store is None or should_store(result)):
+            result_cache.set(key, result)
+        return result
+
+    return await in_flight.do(key, compute_and_store, mode)
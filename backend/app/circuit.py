@@ -0,0 +1,194 @@
+# /app/circuit.py
+# Circuit breaker for remote dependencies (Gemini). It watches a rolling window of call
+# outcomes and latencies; when too many calls fail or are slow it opens and callers fail
+# over immediately instead of waiting for the remote call to fail.
+
+import asyncio
+import contextlib
+import re
+import threading
+import time
+from collections import deque
+
+from app.config import (
+    CIRCUIT_WINDOW_SECONDS, CIRCUIT_MIN_CALLS, CIRCUIT_ERROR_THRESHOLD, CIRCUIT_SLOW_CALL_SECONDS,
+    CIRCUIT_SLOW_CALL_THRESHOLD, CIRCUIT_OPEN_SECONDS, CIRCUIT_HALF_OPEN_CALLS,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_URL = re.compile(r"\b[a-z][a-z0-9+.-]*://[^\s'\"<>]+", re.IGNORECASE)
+
+
+def error_text(error):
+    """An error's message with URLs removed, safe to log or show in /status and error responses.
+
+    HTTP client errors quote the request URL, whose query string can carry credentials.
+    """
+    return _URL.sub("<url>", str(error))
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of calling the dependency while its circuit is open."""
+
+
+class _Call:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency = None  # Callers may set this (e.g. time to first chunk); defaults to the full duration
+
+    def elapsed(self):
+        return self.latency if self.latency is not None else time.monotonic() - self.started
+
+
+class CircuitBreaker:
+    """closed -> open when the error or slow-call rate trips; open -> half_open after a cool-down;
+    half_open -> closed once the trial calls succeed, or back to open on the first failure."""
+
+    def __init__(self, name, window=CIRCUIT_WINDOW_SECONDS, min_calls=CIRCUIT_MIN_CALLS,
+                 error_threshold=CIRCUIT_ERROR_THRESHOLD, slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS,
+                 slow_call_threshold=CIRCUIT_SLOW_CALL_THRESHOLD, open_seconds=CIRCUIT_OPEN_SECONDS,
+                 half_open_calls=CIRCUIT_HALF_OPEN_CALLS):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_threshold = slow_call_threshold
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self.state = CLOSED
+        self.opened_at = None
+        self.last_error = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._calls = deque()  # (finished_at, ok, latency)
+        self._trials_started = 0
+        self._trials_passed = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go through now. Every allowed call must be followed by record() or abandon()."""
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._trials_started = self._trials_passed = 0
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self._trials_started < self.half_open_calls:
+                self._trials_started += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        """Raise CircuitOpenError if allow() would reject a call now, without taking a half-open trial.
+
+        Lets callers skip preparing a request (e.g. shrinking an image) that would not be sent.
+        """
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at < self.open_seconds:
+                pass
+            elif self.state == HALF_OPEN and self._trials_started >= self.half_open_calls:
+                pass
+            else:
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def record(self, ok, latency, error=None):
+        now = time.time()
+        with self._lock:
+            if not ok:
+                self.last_error = error_text(error) if error is not None else "unknown error"
+            if self.state == HALF_OPEN:
+                if ok and latency < self.slow_call_seconds:
+                    self._trials_passed += 1
+                    if self._trials_passed >= self.half_open_calls:
+                        self.state = CLOSED
+                        self._calls.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._calls.append((now, ok, latency))
+            self._expire(now)
+            if self.state == CLOSED and len(self._calls) >= self.min_calls:
+                error_rate, slow_rate = self._rates()
+                if error_rate >= self.error_threshold or slow_rate >= self.slow_call_threshold:
+                    self._open(now)
+
+    def abandon(self):
+        """The allowed call was cancelled before it had an outcome; free its half-open trial slot."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._trials_started > self._trials_passed:
+                self._trials_started -= 1
+
+    @contextlib.asynccontextmanager
+    async def guard(self, ignore=()):
+        """Run an `async with` block as one call through the breaker, recording its outcome.
+
+        Raises CircuitOpenError without running the block while the circuit is open. Exceptions
+        in `ignore` (e.g. local backpressure) say nothing about the dependency and are not counted.
+        A cancelled call only counts if it had already been running for longer than a slow call.
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        call = _Call()
+        try:
+            yield call
+        except ignore:
+            self.abandon()
+            raise
+        except Exception as e:
+            self.record(False, call.elapsed(), e)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            if call.elapsed() >= self.slow_call_seconds:
+                self.record(True, call.elapsed())
+            else:
+                self.abandon()
+            raise
+        else:
+            self.record(True, call.elapsed())
+
+    def snapshot(self):
+        with self._lock:
+            self._expire(time.time())
+            error_rate, slow_rate = self._rates()
+            latencies = sorted(latency for _, _, latency in self._calls)
+            return {
+                "state": self.state,
+                "calls_in_window": len(self._calls),
+                "error_rate": error_rate,
+                "slow_call_rate": slow_rate,
+                "p50_latency": latencies[len(latencies) // 2] if latencies else None,
+                "max_latency": latencies[-1] if latencies else None,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+                "retry_at": self.opened_at + self.open_seconds if self.state == OPEN else None,
+            }
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        print(f"Circuit '{self.name}' opened (last error: {self.last_error}).")
+
+    def _expire(self, now):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _rates(self):
+        if not self._calls:
+            return 0.0, 0.0
+        errors = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, _, latency in self._calls if latency >= self.slow_call_seconds)
+        return errors / len(self._calls), slow / len(self._calls)
+
+
+gemini_breaker = CircuitBreaker("gemini")
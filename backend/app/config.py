@@ -4,6 +4,8 @@ import os
 import sys # Import sys to print warnings to stderr
 from dotenv import load_dotenv
 
+from app.serving import available_cpus, pool_size
+
 # Load environment variables from .env file if it exists
 # Useful for local development
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env') # Assumes .env is in the parent directory of app/
@@ -17,6 +19,48 @@ else:
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", 8000))
 
+# Import the heavy libraries (SymPy, NumPy, PyMuPDF, ...) in a background thread at startup rather
+# than on the first request that needs them (app/lazy.py)
+WARM_UP_IMPORTS = os.getenv("WARM_UP_IMPORTS", "True").lower() in ("true", "1", "t", "yes", "y")
+
+# --- Server Settings ---
+# Cores this process may use (CPU affinity, capped by a container CPU quota); the pool sizes below derive from it
+CPU_COUNT = available_cpus()
+# Threads per Tesseract call. Exported as OMP_THREAD_LIMIT so calls running side by side don't fight over
+# cores; NumPy's BLAS is held to one thread for the same reason.
+OCR_THREADS = int(os.getenv("OCR_THREADS", 1))
+os.environ.setdefault("OMP_THREAD_LIMIT", str(OCR_THREADS))
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+# Server processes sharing this machine. `python main.py` starts Gunicorn with WEB_CONCURRENCY workers (sized
+# from the cores by gunicorn.conf.py unless set) and each gets an equal share of the cores for its pools.
+# A plain `uvicorn app.api:app` is a single process.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+# Gunicorn recycles a worker after SERVER_MAX_REQUESTS requests (plus up to SERVER_MAX_REQUESTS_JITTER, so
+# workers don't restart together) and gives in-flight requests SERVER_GRACEFUL_TIMEOUT seconds on restart
+SERVER_PRELOAD = os.getenv("SERVER_PRELOAD", "True").lower() in ("true", "1", "t", "yes", "y")
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", 2000))
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", 200))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", 60))
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", 5))
+
+# --- Upload Settings ---
+# Uploads over these sizes are rejected with 413 as soon as the limit is crossed, without reading the rest
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 20 * 1024 * 1024))
+PDF_UPLOAD_MAX_BYTES = int(os.getenv("PDF_UPLOAD_MAX_BYTES", 100 * 1024 * 1024))
+# Uploads up to UPLOAD_SPOOL_BYTES stay in memory; larger ones are spooled to a temp file in UPLOAD_DIR
+# (default: the system temp directory) and read through mmap (app/uploads.py)
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 1024 * 1024))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR")
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", 256 * 1024))
+
+# --- Image Decoding Settings ---
+# Images with more pixels than this (width x height, read from the header) are rejected with 413
+# before any pixel is decoded, which also stops decompression bombs
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 80_000_000))
+# Decode JPEGs at 1/2, 1/4 or 1/8 scale when that is still at least the size the OCR or Gemini path needs
+IMAGE_DRAFT_DECODE = os.getenv("IMAGE_DRAFT_DECODE", "True").lower() in ("true", "1", "t", "yes", "y")
+
 # --- Debug Mode ---
 # More robust boolean check for DEBUG environment variable
 DEBUG_STR = os.getenv("DEBUG", "False").lower()
@@ -24,26 +68,106 @@ DEBUG = DEBUG_STR in ("true", "1", "t", "yes", "y")
 
 # --- Tesseract OCR Settings ---
 # Default to 'tesseract' command if not specified in .env
+# (applied by the pytesseract OCR backend when it is created; otherwise tesseract must be on the PATH)
 TESSERACT_CMD = os.getenv("TESSERACT_CMD")
-# Configure pytesseract path only if TESSERACT_CMD is explicitly set
-# Otherwise, assume it's in the system PATH
-if TESSERACT_CMD:
-    try:
-        import pytesseract
-        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
-        print(f"Configured pytesseract command path to: {TESSERACT_CMD}")
-    except ImportError:
-        print("Warning: pytesseract library not found. Cannot configure TESSERACT_CMD.", file=sys.stderr)
-    except Exception as e:
-        print(f"Warning: Failed to set TESSERACT_CMD '{TESSERACT_CMD}'. Error: {e}", file=sys.stderr)
-else:
-    # Check if tesseract is callable from PATH (optional check)
-    # import shutil
-    # if shutil.which("tesseract"):
-    #     print("Using 'tesseract' command found in system PATH.")
-    # else:
-    #     print("Warning: TESSERACT_CMD not set and 'tesseract' not found in PATH. OCR might fail.", file=sys.stderr)
-    pass # Assume tesseract is in PATH if TESSERACT_CMD is not set
+
+
+# --- OCR Engine Settings ---
+# "auto" uses the in-process tesserocr pool when it is installed and falls back to pytesseract.
+# Set to "pytesseract" or "tesserocr" to force a backend.
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Number of warm Tesseract API handles kept by the tesserocr pool (defaults to this process's share of the cores)
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", pool_size(CPU_COUNT, OCR_THREADS, WEB_CONCURRENCY)))
+
+# --- OCR Preprocessing Settings ---
+# Steps applied to uploads before Tesseract sees them (app/preprocess.py); each can be switched off.
+OCR_DOWNSCALE = os.getenv("OCR_DOWNSCALE", "True").lower() in ("true", "1", "t", "yes", "y")
+OCR_DESKEW = os.getenv("OCR_DESKEW", "True").lower() in ("true", "1", "t", "yes", "y")
+OCR_THRESHOLD = os.getenv("OCR_THRESHOLD", "True").lower() in ("true", "1", "t", "yes", "y")
+OCR_AUTOCROP = os.getenv("OCR_AUTOCROP", "True").lower() in ("true", "1", "t", "yes", "y")
+# Downscaling shrinks images until text lines are about this many pixels tall (never enlarges),
+# and always to at most OCR_MAX_PIXELS pixels
+OCR_TARGET_LINE_HEIGHT = int(os.getenv("OCR_TARGET_LINE_HEIGHT", 40))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", 4_000_000))
+# Largest skew (in degrees) the deskew step looks for
+OCR_DESKEW_MAX_ANGLE = float(os.getenv("OCR_DESKEW_MAX_ANGLE", 10.0))
+
+# --- OCR Layout Settings ---
+# Pages of at least OCR_LAYOUT_MIN_PIXELS (after preprocessing) are split into text blocks (app/layout.py)
+# that are recognized side by side on up to OCR_REGION_WORKERS threads. A page only fans out over the CPU pool
+# workers that are idle (and not reserved by another page) when it starts, so under load its regions are read
+# one after the other; the split itself does not depend on load.
+OCR_LAYOUT = os.getenv("OCR_LAYOUT", "True").lower() in ("true", "1", "t", "yes", "y")
+OCR_LAYOUT_MIN_PIXELS = int(os.getenv("OCR_LAYOUT_MIN_PIXELS", 500_000))
+OCR_REGION_WORKERS = int(os.getenv("OCR_REGION_WORKERS", pool_size(CPU_COUNT, OCR_THREADS, WEB_CONCURRENCY)))
+
+
+# --- Worker Pool Settings ---
+# CPU-bound stages (OCR, PDF, SymPy) run in a process pool, I/O-bound stages (Gemini, Twilio) in a thread pool.
+# Set CPU_EXECUTOR=thread to keep everything in-process (useful on platforms without fork).
+CPU_EXECUTOR = os.getenv("CPU_EXECUTOR", "process").lower()
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", pool_size(CPU_COUNT, OCR_THREADS, WEB_CONCURRENCY)))
+IO_WORKERS = int(os.getenv("IO_WORKERS", 32))
+# Maximum number of calls running at once per stage
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", CPU_WORKERS))
+PDF_CONCURRENCY = int(os.getenv("PDF_CONCURRENCY", CPU_WORKERS))
+SYMPY_CONCURRENCY = int(os.getenv("SYMPY_CONCURRENCY", CPU_WORKERS))
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", 16))
+TWILIO_CONCURRENCY = int(os.getenv("TWILIO_CONCURRENCY", 4))
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY", CPU_WORKERS))
+# Calls allowed to wait per stage before new requests are rejected with 503 + Retry-After
+STAGE_QUEUE_DEPTH = int(os.getenv("STAGE_QUEUE_DEPTH", 32))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", 5))
+
+
+# --- Math Explanation Settings ---
+EXPLAIN_BATCH_MAX_ITEMS = int(os.getenv("EXPLAIN_BATCH_MAX_ITEMS", 200))
+# Per-expression time budget for /explain/batch, in seconds
+EXPLAIN_ITEM_TIMEOUT = float(os.getenv("EXPLAIN_ITEM_TIMEOUT", 5))
+# Parsed expressions and their explanations memoized per worker process
+EXPLAIN_CACHE_SIZE = int(os.getenv("EXPLAIN_CACHE_SIZE", 4096))
+# Inputs over these limits are never parsed; they get a rule-based explanation instead
+EXPLAIN_MAX_LENGTH = int(os.getenv("EXPLAIN_MAX_LENGTH", 500))
+EXPLAIN_MAX_DEPTH = int(os.getenv("EXPLAIN_MAX_DEPTH", 20))
+EXPLAIN_MAX_POWERS = int(os.getenv("EXPLAIN_MAX_POWERS", 10))
+# Guarded mode runs SymPy parse/evaluate in killable sandbox processes with a wall-clock timeout
+SYMPY_GUARDED = os.getenv("SYMPY_GUARDED", "True").lower() in ("true", "1", "t", "yes", "y")
+SYMPY_TIMEOUT = float(os.getenv("SYMPY_TIMEOUT", 2))
+
+# --- PDF Extraction Settings ---
+# Large PDFs are split into page ranges extracted in parallel by the CPU pool.
+# Anything smaller than these thresholds stays on the single-process path.
+PDF_PARALLEL_MIN_BYTES = int(os.getenv("PDF_PARALLEL_MIN_BYTES", 512 * 1024))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 32))
+PDF_PAGES_PER_WORKER = int(os.getenv("PDF_PAGES_PER_WORKER", 16))
+# /pdf-upload/stream extracts this many pages per call to the pdf stage
+PDF_STREAM_PAGES = int(os.getenv("PDF_STREAM_PAGES", 8))
+# Pages without a text layer (scanned handouts) are rasterized at PDF_OCR_DPI and run through OCR
+PDF_OCR_ENABLED = os.getenv("PDF_OCR_ENABLED", "True").lower() in ("true", "1", "t", "yes", "y")
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", 300))
+
+
+# --- Result Cache Settings ---
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "True").lower() in ("true", "1", "t", "yes", "y")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", 7 * 24 * 3600))
+# Optional on-disk tier that survives restarts; leave unset to keep the cache in memory only
+CACHE_DIR = os.getenv("CACHE_DIR")
+CACHE_DISK_MAX_BYTES = int(os.getenv("CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+
+
+# --- Background Job Settings ---
+# Jobs and their uploaded inputs are kept here (SQLite queue + input files), so queued work survives restarts
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.dirname(__file__), "..", "jobs"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", 4))
+# Jobs (and their results) are deleted this many seconds after they were submitted
+JOBS_TTL_SECONDS = int(os.getenv("JOBS_TTL_SECONDS", 24 * 3600))
+# Submissions are rejected with 503 + Retry-After while this many jobs are waiting
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", 500))
+# How often idle workers and WebSocket subscribers check the queue for changes from other processes
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", 1.0))
 
 
 # --- Google Generative AI (Gemini) Settings ---
@@ -53,6 +177,33 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY and DEBUG: # Only show warning in debug mode or always? Let's make it always for clarity.
     print("Warning: GOOGLE_API_KEY environment variable not set. Google Gemini features will be disabled, falling back to OCR where applicable.", file=sys.stderr)
 
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+# Point this at a local stub server (see benchmarks/gemini_stub.py) for offline testing
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+# Per-call timeout for Gemini requests, in seconds
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 30))
+# Images are shrunk before upload: cropped to their content, resized so the longest side is at most
+# GEMINI_IMAGE_MAX_SIDE and re-encoded (photos as JPEG at GEMINI_JPEG_QUALITY, graphics as PNG)
+GEMINI_IMAGE_SHRINK = os.getenv("GEMINI_IMAGE_SHRINK", "True").lower() in ("true", "1", "t", "yes", "y")
+GEMINI_IMAGE_MAX_SIDE = int(os.getenv("GEMINI_IMAGE_MAX_SIDE", 1536))
+GEMINI_JPEG_QUALITY = int(os.getenv("GEMINI_JPEG_QUALITY", 85))
+# Hedged mode starts local OCR HEDGE_DELAY seconds into a Gemini call and answers with the best
+# result available once HEDGE_DEADLINE seconds have passed
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "False").lower() in ("true", "1", "t", "yes", "y")
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", 1.0))
+HEDGE_DEADLINE = float(os.getenv("HEDGE_DEADLINE", 8.0))
+# Circuit breaker: over the last CIRCUIT_WINDOW_SECONDS (and at least CIRCUIT_MIN_CALLS calls), open
+# when the error rate or the share of calls slower than CIRCUIT_SLOW_CALL_SECONDS reaches its threshold.
+# While open, requests go straight to OCR; after CIRCUIT_OPEN_SECONDS, CIRCUIT_HALF_OPEN_CALLS trial
+# calls decide whether to close again.
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", 60))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", 5))
+CIRCUIT_ERROR_THRESHOLD = float(os.getenv("CIRCUIT_ERROR_THRESHOLD", 0.5))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", 10.0))
+CIRCUIT_SLOW_CALL_THRESHOLD = float(os.getenv("CIRCUIT_SLOW_CALL_THRESHOLD", 0.8))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", 2))
+
 
 # --- You could add other configurations here as needed ---
 # Example: Allowed origins for CORS (though handled in main app middleware now)
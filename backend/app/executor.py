@@ -0,0 +1,222 @@
+# /app/executor.py
+# Runs blocking work off the event loop. CPU-bound stages (tesseract, fitz, sympy) go to a
+# process pool, blocking I/O (Twilio) to a thread pool, and Gemini runs as non-blocking
+# coroutines. Every stage has its own concurrency limit and a bounded wait queue; when the
+# queue is full the request is rejected with 503 + Retry-After instead of piling up.
+
+import asyncio
+import contextlib
+import functools
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from app import lazy, metrics, serving
+from app.config import (
+    CPU_EXECUTOR, CPU_WORKERS, IO_WORKERS,
+    OCR_CONCURRENCY, PDF_CONCURRENCY, SYMPY_CONCURRENCY, GEMINI_CONCURRENCY, TWILIO_CONCURRENCY, IMAGE_CONCURRENCY,
+    STAGE_QUEUE_DEPTH, RETRY_AFTER_SECONDS, SYMPY_GUARDED,
+)
+
+
+class StageOverloaded(HTTPException):
+    """Raised when a stage already has a full wait queue."""
+
+    def __init__(self, stage):
+        super().__init__(
+            status_code=503,
+            detail=f"Server is busy ({stage} queue is full). Please retry shortly.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+
+
+class _WorkerHTTPError(Exception):
+    """Picklable stand-in for an HTTPException raised inside a worker process."""
+
+
+def _invoke(fn, args, kwargs):
+    # HTTPException cannot be unpickled in the parent, so ship its fields instead.
+    # Step timings recorded during the call travel back with the result.
+    try:
+        with metrics.collect() as steps:
+            return fn(*args, **kwargs), steps
+    except HTTPException as e:
+        raise _WorkerHTTPError(e.status_code, e.detail) from None
+
+
+def _init_cpu_worker():
+    """Warm an OCR handle per worker process (more are opened if a page is split into regions)."""
+    from app import ocr
+    serving.prepare_child_process()
+    ocr.init_worker_backend()
+
+
+class Stage:
+    """A named pipeline stage with a concurrency limit and a bounded wait queue."""
+
+    def __init__(self, name, kind, concurrency, max_queue=STAGE_QUEUE_DEPTH):
+        self.name = name
+        self.kind = kind  # "cpu", "io" or "async" (coroutines run on the event loop via run_async)
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self._semaphore = None
+
+    @property
+    def queue_depth(self):
+        return self.waiting
+
+    async def _acquire(self):
+        """Wait for one of the stage's concurrency slots; returns the time it was acquired."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self.running >= self.concurrency and self.waiting >= self.max_queue:
+            metrics.STAGE_REJECTED.inc(stage=self.name)
+            raise StageOverloaded(self.name)
+
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        acquired = time.perf_counter()
+        metrics.STAGE_WAIT_SECONDS.observe(acquired - start, stage=self.name, endpoint=metrics.current_endpoint.get())
+        self.running += 1
+        return acquired
+
+    def _release(self, acquired):
+        self.running -= 1
+        self._semaphore.release()
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - acquired, stage=self.name,
+                                      endpoint=metrics.current_endpoint.get())
+
+    def _finished(self, acquired, extra, future):
+        if not future.cancelled():
+            future.exception()  # Mark it retrieved: nobody awaits the work of a cancelled caller
+        _release_cpu_workers(extra)
+        self._release(acquired)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one of the stage's concurrency slots for the duration of an `async with` block."""
+        acquired = await self._acquire()
+        try:
+            yield
+        finally:
+            self._release(acquired)
+
+    async def run(self, fn, *args, **kwargs):
+        return await self._run(fn, args, kwargs)
+
+    async def run_wide(self, fn, max_workers, *args, **kwargs):
+        """Like run(), for a call that can spread its work over several CPU pool workers.
+
+        Once the call has its slot it is given `workers=`: its own worker plus the idle ones, at most
+        `max_workers`. The extra workers stay reserved until the call is done, so concurrent calls
+        never fan out over the same idle workers.
+        """
+        return await self._run(fn, args, kwargs, max_workers)
+
+    async def _run(self, fn, args, kwargs, max_workers=1):
+        if self.kind == "cpu" and CPU_EXECUTOR == "process" and not lazy.warmed_up():
+            # Pool processes are forked on demand; never fork in the middle of an import
+            await asyncio.to_thread(lazy.wait_for_warm_up)
+        acquired = await self._acquire()
+        extra = _reserve_cpu_workers(max_workers - 1)
+        if max_workers > 1:
+            kwargs = {**kwargs, "workers": 1 + extra}
+        loop = asyncio.get_running_loop()
+        call = functools.partial(_invoke, fn, args, kwargs)
+        try:
+            future = loop.run_in_executor(_get_executor(self.kind), call)
+        except BaseException:
+            _release_cpu_workers(extra)
+            self._release(acquired)
+            raise
+        # Cancelling the caller does not stop work already handed to the pool, so the slot is held
+        # until that work is done rather than until the caller goes away; otherwise the next call
+        # would get a "free" slot and still queue in the pool behind the orphaned work
+        future.add_done_callback(functools.partial(self._finished, acquired, extra))
+        try:
+            result, steps = await asyncio.shield(future)
+        except _WorkerHTTPError as e:
+            raise HTTPException(status_code=e.args[0], detail=e.args[1])
+        metrics.replay(steps)
+        return result
+
+    async def run_async(self, coro_fn, *args, **kwargs):
+        """Like run(), but for a coroutine function that does its own non-blocking I/O."""
+        async with self.slot():
+            return await coro_fn(*args, **kwargs)
+
+
+STAGES = {
+    "ocr": Stage("ocr", "cpu", OCR_CONCURRENCY),
+    "pdf": Stage("pdf", "cpu", PDF_CONCURRENCY),
+    # In guarded mode SymPy already runs in its own killable sandbox processes; the stage thread only waits on it
+    "sympy": Stage("sympy", "io" if SYMPY_GUARDED else "cpu", SYMPY_CONCURRENCY),
+    "gemini": Stage("gemini", "async", GEMINI_CONCURRENCY),
+    "image": Stage("image", "cpu", IMAGE_CONCURRENCY),  # Shrinking images before they are sent to Gemini
+    "twilio": Stage("twilio", "io", TWILIO_CONCURRENCY),
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(kind):
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                if kind == "cpu" and CPU_EXECUTOR == "process":
+                    executor = ProcessPoolExecutor(max_workers=CPU_WORKERS, initializer=_init_cpu_worker)
+                elif kind == "cpu":
+                    executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+                else:
+                    executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+                _executors[kind] = executor
+    return executor
+
+
+_reserved_cpu_workers = 0  # Idle workers taken by run_wide() calls that are spreading their work over them
+
+
+def idle_cpu_workers():
+    """CPU pool workers neither taken by a running stage call nor reserved by a call's fan-out."""
+    busy = sum(stage.running for stage in STAGES.values() if stage.kind == "cpu")
+    return max(0, CPU_WORKERS - busy - _reserved_cpu_workers)
+
+
+def _reserve_cpu_workers(wanted):
+    global _reserved_cpu_workers
+    reserved = max(0, min(wanted, idle_cpu_workers()))
+    _reserved_cpu_workers += reserved
+    return reserved
+
+
+def _release_cpu_workers(reserved):
+    global _reserved_cpu_workers
+    _reserved_cpu_workers -= reserved
+
+
+async def run_stage(stage, fn, *args, **kwargs):
+    """Run a blocking function in the pool for `stage` ("ocr", "pdf", "sympy", "image", "twilio")."""
+    return await STAGES[stage].run(fn, *args, **kwargs)
+
+
+async def run_stage_wide(stage, fn, max_workers, *args, **kwargs):
+    """Run a blocking function that takes `workers=` in the pool for `stage`, see Stage.run_wide()."""
+    return await STAGES[stage].run_wide(fn, max_workers, *args, **kwargs)
+
+
+def shutdown_executors():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
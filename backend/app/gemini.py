@@ -0,0 +1,206 @@
+# /app/gemini.py
+# Long-lived async client for the Gemini REST API. One httpx.AsyncClient (and its pool of
+# keep-alive connections) is shared by every call, and model handles are created once per
+# model name. GEMINI_API_BASE can point at a local stub server for offline testing.
+
+import asyncio
+import base64
+import io
+import json
+
+from app.config import (
+    GOOGLE_API_KEY, GEMINI_API_BASE, GEMINI_MODEL, GEMINI_TIMEOUT, GEMINI_CONCURRENCY,
+    GEMINI_IMAGE_MAX_SIDE, GEMINI_JPEG_QUALITY,
+)
+from app.images import load_image
+from app.lazy import LazyModule
+from app.preprocess import content_box, ink_mask
+from app.uploads import as_upload
+
+httpx = LazyModule("httpx")
+np = LazyModule("numpy")
+Image = LazyModule("PIL.Image")
+ImageOps = LazyModule("PIL.ImageOps")
+
+# Image formats Gemini accepts as inline data; anything else is re-encoded to PNG
+SUPPORTED_MIME_TYPES = {"image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"}
+
+
+def image_part(image_data):
+    """Build an inline_data part, sending the uploaded bytes as-is when the format allows it."""
+    upload = as_upload(image_data)
+    with upload.open() as f:
+        mime_type = Image.MIME.get(Image.open(f).format or "")  # Only reads the header
+    if mime_type not in SUPPORTED_MIME_TYPES:
+        img, _ = load_image(upload)
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        upload, mime_type = as_upload(buffer.getvalue()), "image/png"
+    with upload.view() as view:
+        data = base64.b64encode(view).decode("ascii")
+    return {"inline_data": {"mime_type": mime_type, "data": data}}
+
+
+def shrink_image(image_data, max_side=GEMINI_IMAGE_MAX_SIDE, quality=GEMINI_JPEG_QUALITY):
+    """Crop empty margins, cap the longest side at `max_side` and re-encode for upload.
+
+    Photos (many colors) become JPEG, graphics and screenshots stay lossless PNG. Returns the
+    re-encoded bytes, or None if re-encoding would not make the image smaller.
+    """
+    img, stored_size = load_image(image_data, max_side=max_side)  # Large JPEGs decode at a reduced scale
+    source_format = img.format
+    reduced = img.size != stored_size
+    img = ImageOps.exif_transpose(img)  # Re-encoding drops EXIF, so apply its orientation now
+    if img.mode not in ("L", "RGB", "RGBA", "LA", "P"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    original_size = img.size
+
+    # Judge margins and colors on a reduced copy
+    factor = max(1, -(-max(img.size) // 1024))
+    small = img.convert("RGB").reduce(factor)
+    box = content_box(ink_mask(np.asarray(small.convert("L"))))
+    if box is not None and (box[2] - box[0]) * (box[3] - box[1]) < 0.9 * small.width * small.height:
+        img = img.crop(tuple(min(edge * factor, limit) for edge, limit in zip(box, img.size * 2)))
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    photo = source_format == "JPEG" or small.getcolors(4096) is None
+    if photo:
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    else:
+        img.save(buffer, format="PNG", optimize=True)
+    data = buffer.getvalue()
+
+    if len(data) >= len(image_data) and img.size == original_size and not reduced:
+        return None
+    return data
+
+
+def chunk_text(data):
+    """Text of one streamed chunk ("" if the chunk carries no text)."""
+    for candidate in data.get("candidates", [])[:1]:
+        return "".join(part.get("text", "") for part in candidate.get("content", {}).get("parts", []))
+    return ""
+
+
+def response_text(data):
+    """Extract the generated text, or a readable message for blocked and empty responses."""
+    parts = []
+    for candidate in data.get("candidates", [])[:1]:
+        parts = [part.get("text", "") for part in candidate.get("content", {}).get("parts", [])]
+    if not parts:
+        # Check for blocked prompt
+        block_reason = data.get("promptFeedback", {}).get("blockReason")
+        if block_reason:
+            return f"Request blocked due to: {block_reason}. Explanation could not be generated."
+        return "Gemini returned an empty response. Could not generate explanation."
+    return "".join(parts)
+
+
+# Bad request (an invalid key), unauthenticated, forbidden, and an unknown model
+KEY_ERROR_STATUSES = (400, 401, 403, 404)
+
+
+class GeminiKeyError(Exception):
+    """The Gemini API rejected the API key or model name."""
+
+
+class GeminiModel:
+    """A handle on one Gemini model that reuses the client's connections."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.path = f"/v1beta/models/{name}"
+
+    @staticmethod
+    def _body(prompt, image):
+        # `image` is a part from image_part() (build it off the event loop, e.g. in the image stage)
+        # or image bytes/an Upload, which are converted here
+        part = image if isinstance(image, dict) else image_part(image)
+        return {"contents": [{"role": "user", "parts": [{"text": prompt}, part]}]}
+
+    async def generate_content(self, prompt, image, timeout=GEMINI_TIMEOUT):
+        body = self._body(prompt, image)
+        # wait_for bounds the whole call; httpx's own timeout only bounds each network phase
+        response = await asyncio.wait_for(
+            self.client.http().post(f"{self.path}:generateContent", json=body),
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return response_text(response.json())
+
+    async def stream_content(self, prompt, image):
+        """Yield the response text chunk by chunk as Gemini generates it (server-sent events)."""
+        body = self._body(prompt, image)
+        received_text = False
+        async with self.client.http().stream(
+            "POST", f"{self.path}:streamGenerateContent", params={"alt": "sse"}, json=body,
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = json.loads(line[len("data:"):])
+                text = chunk_text(data)
+                if text:
+                    received_text = True
+                    yield text
+                elif not received_text and data.get("promptFeedback", {}).get("blockReason"):
+                    yield response_text(data)
+                    return
+        if not received_text:
+            yield response_text({})
+
+
+class GeminiClient:
+    def __init__(self, api_key=GOOGLE_API_KEY, base_url=GEMINI_API_BASE, max_connections=GEMINI_CONCURRENCY,
+                 timeout=GEMINI_TIMEOUT):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._http = None
+        self._models = {}
+
+    def http(self):
+        # Created on first use so it binds to the serving event loop
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"x-goog-api-key": self.api_key},  # Not a query parameter, so URLs in errors and logs don't carry it
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._http
+
+    def model(self, name=GEMINI_MODEL):
+        if name not in self._models:
+            self._models[name] = GeminiModel(self, name)
+        return self._models[name]
+
+    async def check_model(self, name=GEMINI_MODEL, timeout=10):
+        """Check that the API key works and the model exists.
+
+        Raises GeminiKeyError if the API rejects them, other exceptions if it can't be reached or
+        answers with a passing error (like 429 or 408), which say nothing about the key.
+        """
+        response = await self.http().get(f"/v1beta/models/{name}", timeout=timeout)
+        if response.status_code in KEY_ERROR_STATUSES:
+            raise GeminiKeyError(f"{response.status_code} {response.text[:200]}")
+        response.raise_for_status()
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+gemini_client = GeminiClient()
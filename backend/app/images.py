@@ -0,0 +1,74 @@
+# /app/images.py
+# Loading uploaded images without decoding pixels that are thrown away later. The header is read
+# first, so an image over the pixel budget (or a decompression bomb) is rejected before anything is
+# decoded. JPEGs are then decoded directly at a reduced scale (libjpeg DCT scaling through
+# Image.draft) that is still at least as large as the caller needs.
+
+from fastapi import HTTPException
+
+from app.config import IMAGE_MAX_PIXELS, IMAGE_DRAFT_DECODE
+from app.lazy import LazyModule
+from app.uploads import as_upload
+
+Image = LazyModule("PIL.Image")
+
+
+class ImageTooLarge(HTTPException):
+    """Raised when an image's header reports more pixels than the budget allows."""
+
+    def __init__(self, size, budget):
+        pixels = f"{size[0]}x{size[1]} pixels, " if size else ""
+        super().__init__(status_code=413, detail=f"Image is too large ({pixels}the limit is {budget} pixels)")
+
+
+def open_image(f, budget):
+    """Image.open() that turns Pillow's own decompression bomb error into ImageTooLarge."""
+    try:
+        img = Image.open(f)
+    except Image.DecompressionBombError:
+        raise ImageTooLarge(None, budget)
+    if img.width * img.height > budget:
+        raise ImageTooLarge(img.size, budget)
+    return img
+
+
+def check_image(image_data, budget=IMAGE_MAX_PIXELS):
+    """Raise ImageTooLarge if the image is over the pixel budget. Only the header is read.
+
+    Data that isn't a readable image passes; the pipeline reports that as it always has.
+    """
+    with as_upload(image_data).open() as f:
+        try:
+            open_image(f, budget)
+        except ImageTooLarge:
+            raise
+        except Exception:
+            pass
+
+
+def draft_size(size, max_side=None, max_pixels=None):
+    """The smallest size, keeping the aspect ratio, that still satisfies `max_side` and `max_pixels`."""
+    width, height = size
+    factor = 1.0
+    if max_side:
+        factor = max(factor, max(width, height) / max_side)
+    if max_pixels:
+        factor = max(factor, (width * height / max_pixels) ** 0.5)
+    return max(1, int(width / factor)), max(1, int(height / factor))
+
+
+def load_image(image_data, max_side=None, max_pixels=None, mode=None, budget=IMAGE_MAX_PIXELS):
+    """Decode an image (bytes or an Upload), checking the pixel budget before decoding anything.
+
+    `max_side`/`max_pixels` describe the largest image the caller will use; JPEGs are decoded at
+    the smallest DCT scale that is still at least that big (the caller still resizes to the exact
+    size). `mode` ("L", "RGB") lets the JPEG decoder skip a color conversion.
+    Returns (image, (width, height) as stored in the file).
+    """
+    with as_upload(image_data).open() as f:
+        img = open_image(f, budget)
+        original_size = img.size
+        if IMAGE_DRAFT_DECODE and (max_side or max_pixels or mode):
+            img.draft(mode, draft_size(original_size, max_side, max_pixels))  # A no-op for formats other than JPEG
+        img.load()
+    return img, original_size
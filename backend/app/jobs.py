@@ -0,0 +1,337 @@
+# /app/jobs.py
+# Background jobs for long-running work (large PDFs, slow Gemini analyses). Submitting returns a
+# job id right away; the job waits in a SQLite-backed queue on local disk, so queued work survives
+# restarts and can be shared by several server processes. Clients poll or subscribe (WebSocket)
+# for progress, then fetch the result. Jobs can be cancelled and are deleted once they expire.
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from fastapi import HTTPException
+
+from app import metrics
+from app.config import (
+    JOBS_DIR, JOBS_WORKERS, JOBS_TTL_SECONDS, JOBS_MAX_QUEUED, JOBS_POLL_INTERVAL, RETRY_AFTER_SECONDS,
+)
+from app.executor import StageOverloaded
+from app.uploads import Upload, as_upload
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+HEARTBEAT_SECONDS = 5  # Running jobs refresh their heartbeat this often
+STALE_SECONDS = 30  # A running job whose heartbeat is older than this lost its process and is queued again
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    not_before REAL NOT NULL DEFAULT 0,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    """Persistent job queue plus the workers that run its jobs.
+
+    `handlers` maps a job kind to `async handler(data, progress)`, where `data` is the job's
+    Upload (app/uploads.py) and `progress(**fields)` records progress (merged into the job's `progress` dict).
+    The handler's return value (JSON-serializable) becomes the job's result.
+    """
+
+    def __init__(self, handlers, directory=JOBS_DIR, workers=JOBS_WORKERS, ttl=JOBS_TTL_SECONDS,
+                 max_queued=JOBS_MAX_QUEUED, poll_interval=JOBS_POLL_INTERVAL):
+        self.handlers = handlers
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._tasks = {}  # Job id -> handler task running in this process
+        self._watchers = {}  # Job id -> set of asyncio.Events to set when the job changes
+        self._wakeup = None
+        self._background = []
+        self._stopping = False
+
+    # --- Public API ---
+
+    async def start(self):
+        self._connection()
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._background = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._background.append(asyncio.ensure_future(self._housekeeping()))
+
+    async def stop(self):
+        """Stop the workers. Jobs that were running go back to the queue and resume on the next start."""
+        self._stopping = True
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._background = []
+
+    async def submit(self, kind, data):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._count(QUEUED) >= self.max_queued:
+            raise StageOverloaded("jobs")
+
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._write_input, job_id, data)
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, created_at, updated_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, now, now, now + self.ttl),
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """The job as a dict, or None if it does not exist (or has expired)."""
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["expires_at"] < time.time():
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": json.loads(row["progress"]),
+            "result": json.loads(row["result"]) if row["result"] is not None else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "expires_at": row["expires_at"],
+        }
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job, or None if it does not exist."""
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+            (CANCELLED, time.time(), job_id, QUEUED, RUNNING),
+        )
+        if cursor.rowcount:
+            task = self._tasks.get(job_id)
+            if task is not None:
+                task.cancel()  # _run() records the cancellation and removes the input
+            else:
+                # Queued, or running in another process (whose housekeeping cancels it within HEARTBEAT_SECONDS)
+                self._remove_input(job_id)
+            self._notify(job_id)
+        return self.get(job_id)
+
+    async def watch(self, job_id):
+        """Yield the job each time it changes, ending after it finishes (or disappears)."""
+        changed = asyncio.Event()
+        self._watchers.setdefault(job_id, set()).add(changed)
+        try:
+            last = None
+            while True:
+                changed.clear()
+                job = self.get(job_id)
+                if job is None:
+                    return
+                if job["updated_at"] != last:
+                    last = job["updated_at"]
+                    yield job
+                if job["status"] in FINISHED:
+                    return
+                # Local updates wake us right away; polling picks up updates from other processes
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._watchers[job_id].discard(changed)
+            if not self._watchers[job_id]:
+                del self._watchers[job_id]
+
+    def snapshot(self):
+        rows = self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {"running_here": len(self._tasks), **{row["status"]: row["n"] for row in rows}}
+
+    # --- Workers ---
+
+    async def _worker(self):
+        # Checking _stopping too: wait_for() can swallow a cancellation that races with the wakeup
+        while not self._stopping:
+            self._wakeup.clear()
+            job = self._claim()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+            self._wakeup.set()  # There may be more queued work for the other idle workers
+
+    async def _run(self, job):
+        job_id = job["id"]
+        try:
+            data = await asyncio.to_thread(self._read_input, job_id)
+        except OSError as e:
+            self._finish(job_id, FAILED, error=f"Job input is missing: {e}")
+            return
+
+        def progress(**fields):
+            self._update_progress(job_id, fields)
+
+        # Label the job's stage and step metrics (the task copies the context when it is created)
+        metrics.current_endpoint.set(f"/jobs/{job['kind']}")
+        task = asyncio.ensure_future(self.handlers[job["kind"]](data, progress))
+        self._tasks[job_id] = task
+        try:
+            result = await task
+            self._finish(job_id, DONE, result=result)
+        except StageOverloaded:
+            # The server is busy; try again later instead of failing the job
+            self._execute(
+                "UPDATE jobs SET status = ?, not_before = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, time.time() + RETRY_AFTER_SECONDS, time.time(), job_id, RUNNING),
+            )
+        except asyncio.CancelledError:
+            if self._stopping:
+                self._execute("UPDATE jobs SET status = ? WHERE id = ? AND status = ?", (QUEUED, job_id, RUNNING))
+                raise
+            self._finish(job_id, CANCELLED)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"Job {job_id} ({job['kind']}) failed: {detail}")
+            self._finish(job_id, FAILED, error=str(detail))
+        finally:
+            del self._tasks[job_id]
+            self._notify(job_id)
+
+    def _claim(self):
+        """Atomically move the oldest runnable queued job to running; None if there is none."""
+        now = time.time()
+        with self._db_lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND not_before <= ? AND expires_at > ? "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, now, now),
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, now, now, row["id"]),
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        if row is not None:
+            self._notify(row["id"])
+        return row
+
+    def _update_progress(self, job_id, fields):
+        # Never raises: the handler may be a computation shared with other requests (see app/singleflight.py),
+        # so cancellation only ever goes through task.cancel()
+        row = self._execute("SELECT status, progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["status"] != RUNNING:
+            return
+        progress = {**json.loads(row["progress"]), **fields}
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET progress = ?, heartbeat_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (json.dumps(progress), now, now, job_id, RUNNING),
+        )
+        self._notify(job_id)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        # Never overwrite a cancellation that arrived while the handler was finishing
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, RUNNING, status),
+        )
+        self._remove_input(job_id)
+
+    async def _housekeeping(self):
+        """Heartbeats for local jobs, cancellations made by other processes, stale jobs and expiry."""
+        while not self._stopping:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            now = time.time()
+            for job_id, task in list(self._tasks.items()):
+                cursor = self._execute(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?", (now, job_id, RUNNING),
+                )
+                if not cursor.rowcount:
+                    task.cancel()  # Cancelled by another process
+            self._execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, now, RUNNING, now - STALE_SECONDS),
+            )
+            expired = self._execute("SELECT id FROM jobs WHERE expires_at < ?", (now,)).fetchall()
+            for row in expired:
+                task = self._tasks.get(row["id"])
+                if task is not None:
+                    task.cancel()
+                self._execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+                self._remove_input(row["id"])
+                self._notify(row["id"])
+
+    # --- Storage ---
+
+    def _connection(self):
+        if self._db is None:
+            os.makedirs(os.path.join(self.directory, "inputs"), exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.directory, "jobs.sqlite3"), check_same_thread=False,
+                                 isolation_level=None, timeout=10)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def _execute(self, sql, params=()):
+        # Statements are small, indexed and local, so they run inline rather than in a thread
+        with self._db_lock:
+            return self._connection().execute(sql, params)
+
+    def _count(self, status):
+        return self._execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def _input_path(self, job_id):
+        return os.path.join(self.directory, "inputs", job_id)
+
+    def _write_input(self, job_id, upload):
+        as_upload(upload).save(self._input_path(job_id))
+
+    def _read_input(self, job_id):
+        # Linked into the spool directory, so a computation shared with another request
+        # (app/singleflight.py) can still read it after this job has removed its input
+        return Upload.from_path(self._input_path(job_id))
+
+    def _remove_input(self, job_id):
+        try:
+            os.remove(self._input_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _notify(self, job_id):
+        for event in self._watchers.get(job_id, ()):
+            event.set()
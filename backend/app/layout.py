@@ -0,0 +1,120 @@
+# /app/layout.py
+# Page layout analysis for region-level OCR. A recursive XY-cut over NumPy projection profiles
+# splits a preprocessed page at wide blank bands: into columns where a blank gap runs the full
+# height of a region, otherwise into horizontal blocks separated by blank rows. The blocks come
+# back in reading order, so they can be recognized independently (and in parallel) and their
+# text joined back together.
+
+from app.lazy import LazyModule
+
+np = LazyModule("numpy")
+
+# Gaps and widths below are in line heights, so they hold at any scale
+ROW_GAP = 1.0  # Blank rows that separate two blocks; the space between lines of a paragraph is well under a line
+COLUMN_GAP = 1.5  # Blank columns that separate two columns; wider than the spaces inside an equation
+MIN_COLUMN_WIDTH = 6  # Narrower pieces (problem numbers, margin marks) stay with the text beside them
+
+
+def ink_spans(counts, noise, min_gap, min_width=0):
+    """[(start, end), ...] of the inked stretches of a projection profile.
+
+    Positions with more than `noise` ink pixels count as ink. Stretches closer than `min_gap`
+    are joined, and stretches narrower than `min_width` are folded into a neighbour.
+    """
+    inked = (counts > noise).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], inked, [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    if len(starts) == 0:
+        return []
+    wide = (starts[1:] - ends[:-1]) >= min_gap
+    starts = np.concatenate((starts[:1], starts[1:][wide]))
+    ends = np.concatenate((ends[:-1][wide], ends[-1:]))
+    spans = list(zip(starts.tolist(), ends.tolist()))
+    i = 0
+    while len(spans) > 1 and i < len(spans):
+        start, end = spans[i]
+        if end - start >= min_width:
+            i += 1
+        elif i + 1 < len(spans):
+            spans[i:i + 2] = [(start, spans[i + 1][1])]
+        else:
+            spans[i - 1:] = [(spans[i - 1][0], end)]
+    return spans
+
+
+def _union(boxes):
+    return (min(b[0] for b in boxes), boxes[0][1], max(b[2] for b in boxes), boxes[-1][3])
+
+
+def _rows(region, line_height):
+    # Like content_box, a row or column needs a few ink pixels to count, so specks don't bridge gaps
+    return ink_spans(region.sum(axis=1), max(1, region.shape[1] // 500), ROW_GAP * line_height)
+
+
+def _columns(region, line_height):
+    return ink_spans(region.sum(axis=0), max(1, region.shape[0] // 500), COLUMN_GAP * line_height,
+                     MIN_COLUMN_WIDTH * line_height)
+
+
+def _cut(mask, box, line_height, max_ink):
+    left, top, right, bottom = box
+    region = mask[top:bottom, left:right]
+    rows = _rows(region, line_height)
+    columns = _columns(region, line_height)
+    if not rows or not columns:
+        return []
+
+    if len(columns) > 1:
+        # Columns are read one after the other, each top to bottom
+        return [block for start, end in columns
+                for block in _cut(mask, (left + start, top, left + end, bottom), line_height, max_ink)]
+
+    if len(rows) > 1:
+        # Something spanning the full width (a title) hides the gutter of the columns below it. Bands
+        # that share a gutter are kept together, so their columns are read one after the other
+        # rather than band by band.
+        groups = [rows[0]]
+        for start, end in rows[1:]:
+            if len(_columns(region[groups[-1][0]:end], line_height)) > 1:
+                groups[-1] = (groups[-1][0], end)
+            else:
+                groups.append((start, end))
+
+        # Consecutive groups that are single blocks span the full width between them, so they can be
+        # joined back into one block; that keeps a page of many short problems from turning into as
+        # many Tesseract calls
+        blocks, run, run_ink = [], [], 0
+        for start, end in groups:
+            band = _cut(mask, (left, top + start, right, top + end), line_height, max_ink)
+            if len(band) != 1:
+                if run:
+                    blocks.append(_union(run))
+                blocks.extend(band)
+                run, run_ink = [], 0
+                continue
+            ink = int(np.count_nonzero(mask[band[0][1]:band[0][3], band[0][0]:band[0][2]]))
+            if run and run_ink + ink > max_ink:
+                blocks.append(_union(run))
+                run, run_ink = [], 0
+            run.append(band[0])
+            run_ink += ink
+        if run:
+            blocks.append(_union(run))
+        return blocks
+
+    return [(left + columns[0][0], top + rows[0][0], left + columns[0][1], top + rows[0][1])]
+
+
+def find_regions(mask, line_height, max_regions):
+    """Text blocks of a page, as (left, top, right, bottom) boxes in reading order.
+
+    `mask` marks the ink and `line_height` is the typical height of a text line in pixels.
+    Blocks stacked in the same column are joined while they hold less than 1/`max_regions` of
+    the page's ink, so the page splits into a few regions of similar size rather than one per line.
+    """
+    total_ink = int(np.count_nonzero(mask))
+    if total_ink == 0:
+        return []
+    h, w = mask.shape
+    max_ink = max(1, total_ink // max(1, max_regions))
+    return _cut(mask, (0, 0, w, h), line_height, max_ink)
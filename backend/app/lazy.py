@@ -0,0 +1,94 @@
+# /app/lazy.py
+# Deferred imports for the heavy libraries (SymPy, NumPy, PyMuPDF, Pillow, pytesseract, httpx).
+# Importing app.api then only loads FastAPI, so a worker starts serving quickly; each library
+# is imported on first use, or ahead of time by warm_up() in a background thread at startup.
+#
+# Worker processes are forked, and a fork taken while another thread is half-way through an
+# import hands the child a module lock it can never acquire. Code that forks calls
+# wait_for_warm_up() first, so children start with every heavy library already loaded.
+
+import importlib
+import threading
+import time
+
+# Imported by warm_up(), roughly in the order requests need them
+WARM_UP_MODULES = (
+    "httpx",
+    "numpy",
+    "PIL.Image",
+    "PIL.ImageFilter",
+    "PIL.ImageOps",
+    "pytesseract",
+    "fitz",
+    "sympy",
+    "sympy.parsing.sympy_parser",
+)
+
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access.
+
+    `np = LazyModule("numpy")` at module level, then `np.asarray(...)` inside functions as usual.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)  # Thread-safe, and cached in sys.modules
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def warm_up(modules=WARM_UP_MODULES):
+    """Import `modules` now; returns {name: seconds or error}. Meant to run in a background thread."""
+    timings = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            timings[name] = time.perf_counter() - start
+        except Exception as e:  # An optional dependency that's missing only fails the requests that need it
+            timings[name] = f"{type(e).__name__}: {e}"
+    return timings
+
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+
+def warm_up_in_background(modules=WARM_UP_MODULES, log=True):
+    """Start warm_up() in a daemon thread (once per process); returns the thread."""
+    global _warm_up_thread
+
+    def run():
+        start = time.perf_counter()
+        timings = warm_up(modules)
+        failed = {name: error for name, error in timings.items() if isinstance(error, str)}
+        if log:
+            print(f"Warm-up imported {len(timings) - len(failed)} modules in {time.perf_counter() - start:.2f}s")
+        for name, error in failed.items():
+            print(f"Warning: could not import {name} during warm-up: {error}")
+
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=run, name="warm-up", daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
+
+
+def warmed_up():
+    return _warm_up_thread is not None and not _warm_up_thread.is_alive()
+
+
+def wait_for_warm_up():
+    """Block until the warm-up has finished, starting it if nothing has yet."""
+    warm_up_in_background().join()
@@ -0,0 +1,216 @@
+# /app/math_explain.py
+# Plain-English explanations of math expressions using SymPy, with a rule-based fallback.
+
+import re
+from functools import lru_cache
+
+from app.config import (
+    EXPLAIN_CACHE_SIZE, SYMPY_GUARDED, SYMPY_TIMEOUT, SYMPY_CONCURRENCY,
+    EXPLAIN_MAX_LENGTH, EXPLAIN_MAX_DEPTH, EXPLAIN_MAX_POWERS,
+)
+from app import metrics
+from app.lazy import LazyModule
+from app.sandbox import SandboxCrashed, SandboxPool, SandboxTimeout
+
+sympy = LazyModule("sympy")
+sympy_parser = LazyModule("sympy.parsing.sympy_parser")
+
+# Common LaTeX replacements for the subset we support
+LATEX_REPLACEMENTS = {
+    r"\frac": "/", r"\cdot": "*", r"\times": "*", r"\div": "/",
+    r"\sqrt": "sqrt", r"\pi": "pi", r"\alpha": "alpha", r"\beta": "beta",
+    r"\sum": "sum", r"\int": "integral", r"\infty": "oo", r"\sin": "sin",
+    r"\cos": "cos", r"\tan": "tan", r"\log": "log", r"\ln": "ln",
+    r"\exp": "exp", r"^": "**", r"_": "", r"{": "", r"}": "",
+    r"\left": "", r"\right": "", r"\lim": "limit",
+}
+# One compiled alternation, longest token first, so the whole string is translated in a single
+# pass (and "\infty" is not mistaken for "\int" followed by "fty").
+_LATEX_PATTERN = re.compile("|".join(re.escape(token) for token in sorted(LATEX_REPLACEMENTS, key=len, reverse=True)))
+
+
+@lru_cache(maxsize=None)
+def parse_transformations():
+    """Try to parse with SymPy, with implicit multiplication."""
+    return sympy_parser.standard_transformations + (sympy_parser.implicit_multiplication,)
+
+
+def normalize_latex(expression):
+    """Translate the supported LaTeX commands into SymPy-parsable text."""
+    return _LATEX_PATTERN.sub(lambda match: LATEX_REPLACEMENTS[match.group(0)], expression)
+
+
+@lru_cache(maxsize=EXPLAIN_CACHE_SIZE)
+def parse_and_explain(clean_expr):
+    """Parse normalized text and explain it, memoized per worker process.
+
+    Returns (sympy expression, explanation, None) on success or (None, None, error message)
+    when parsing fails, so failures are cached too.
+    """
+    try:
+        with metrics.timed_step("sympy_parse"):
+            sympy_expr = sympy_parser.parse_expr(clean_expr, transformations=parse_transformations())
+    except Exception as e:
+        return None, None, str(e)
+    with metrics.timed_step("sympy_evaluate"):
+        explanation = explain_sympy_expression(sympy_expr)
+    return sympy_expr, explanation, None
+
+
+def check_expression_limits(text):
+    """Return why `text` is too big or too deeply nested to hand to SymPy, or None if it is fine."""
+    if len(text) > EXPLAIN_MAX_LENGTH:
+        return f"expression is longer than {EXPLAIN_MAX_LENGTH} characters"
+    depth = max_depth = 0
+    for char in text:
+        if char in "([{":
+            depth += 1
+            max_depth = max(max_depth, depth)
+        elif char in ")]}":
+            depth -= 1
+    if max_depth > EXPLAIN_MAX_DEPTH:
+        return f"expression is nested more than {EXPLAIN_MAX_DEPTH} levels deep"
+    if text.count("**") + text.count("^") > EXPLAIN_MAX_POWERS:
+        return f"expression has more than {EXPLAIN_MAX_POWERS} powers"
+    return None
+
+
+def sandbox_explain(clean_expr):
+    """Entry point inside a sandbox process; only the explanation text (and step timings) are sent back."""
+    with metrics.collect() as steps:
+        _, explanation, parse_error = parse_and_explain(clean_expr)
+    return explanation, parse_error, steps
+
+
+sandbox_pool = SandboxPool(SYMPY_CONCURRENCY)
+
+
+@lru_cache(maxsize=EXPLAIN_CACHE_SIZE)
+def explain_guarded(clean_expr):
+    """Explain normalized text within the complexity and time limits.
+
+    Returns (explanation, parse error, limit error). Inputs over the size limits are never
+    parsed; in guarded mode parsing and evaluation run in a sandbox process that is killed
+    after SYMPY_TIMEOUT seconds. The size limits are memoized, so resending a huge expression
+    costs nothing. A timed-out call raises SandboxTimeout and a crashed sandbox worker raises
+    SandboxCrashed instead: both can depend on load, so they must not be memoized.
+    """
+    limit_error = check_expression_limits(clean_expr)
+    if limit_error is not None:
+        return None, None, limit_error
+    if not SYMPY_GUARDED:
+        _, explanation, parse_error = parse_and_explain(clean_expr)
+        return explanation, parse_error, None
+    try:
+        with metrics.timed_step("sympy_sandbox"):
+            explanation, parse_error, steps = sandbox_pool.run(sandbox_explain, clean_expr, timeout=SYMPY_TIMEOUT)
+        metrics.replay(steps)
+    except (SandboxTimeout, SandboxCrashed):
+        raise  # lru_cache does not keep exceptions
+    except RuntimeError as e:
+        return None, str(e), None
+    return explanation, parse_error, None
+
+
+def explain_math_expression(expression, format_type="latex"):
+    """Explain a math expression in plain English using SymPy or rules."""
+    # Remove LaTeX formatting if present
+    clean_expr = normalize_latex(expression) if format_type == "latex" else expression
+    try:
+        explanation, parse_error, limit_error = explain_guarded(clean_expr)
+    except SandboxTimeout as e:
+        explanation, parse_error, limit_error = None, None, f"SymPy {e}"
+    except SandboxCrashed as e:
+        # Answer this request from the text alone; the next one gets a fresh worker
+        print(f"SymPy failed for '{clean_expr}': {e}")
+        explanation, parse_error, limit_error = rule_based_explanation(clean_expr), None, None
+
+    if limit_error is not None:
+        # Too big or too slow for SymPy, describe it from the text alone
+        print(f"SymPy limit tripped for '{clean_expr}': {limit_error}")
+        explanation = rule_based_explanation(clean_expr)
+    elif parse_error is not None and format_type == "latex":
+        # Fall back to rule-based explanation if SymPy fails
+        print(f"SymPy parsing failed for '{clean_expr}' (from LaTeX '{expression}'): {parse_error}")
+        explanation = rule_based_explanation(clean_expr)
+    elif parse_error is not None:
+        print(f"Error explaining math expression '{expression}': {parse_error}")
+        # Provide a fallback explanation if SymPy fails
+        explanation = f"Could not generate a detailed explanation for: {expression}. Error: {parse_error}"
+
+    return {
+        "original": expression,
+        "explanation": explanation
+    }
+
+
+def explain_sympy_expression(expr):
+    """Generate an explanation from a SymPy expression."""
+    explanation = ""
+    try:
+        if isinstance(expr, sympy.Add):
+            terms = [str(arg) for arg in expr.args]
+            explanation = f"This is an addition of the terms: {', '.join(terms)}"
+        elif isinstance(expr, sympy.Mul):
+            factors = [str(arg) for arg in expr.args]
+            explanation = f"This is a multiplication of the factors: {', '.join(factors)}"
+        elif isinstance(expr, sympy.Pow):
+            base, exp = expr.args
+            explanation = f"This represents {base} raised to the power of {exp}"
+        elif isinstance(expr, sympy.Function):
+            name = type(expr).__name__
+            args = ", ".join([str(arg) for arg in expr.args])
+            explanation = f"This is the {name} function applied to {args}"
+        elif isinstance(expr, sympy.Equality):
+            left, right = expr.args
+            explanation = f"This is an equation stating that {left} equals {right}"
+        # Add more specific cases as needed (e.g., Integral, Sum, Limit)
+        elif isinstance(expr, sympy.Integral):
+             func, (var, *bounds) = expr.args
+             bound_str = f" from {bounds[0]} to {bounds[1]}" if bounds else ""
+             explanation = f"This is the integral of {func} with respect to {var}{bound_str}"
+        elif isinstance(expr, sympy.Sum):
+             func, (var, lower, upper) = expr.args
+             explanation = f"This is the summation of {func} for {var} from {lower} to {upper}"
+        elif isinstance(expr, sympy.Limit):
+            func, var, point, direction = expr.args
+            dir_str = f" from the {direction} direction" if direction != '+' else ""
+            explanation = f"This is the limit of {func} as {var} approaches {point}{dir_str}"
+        else:
+            explanation = f"This is a mathematical expression: {expr}"
+            try:
+                # Check if it's numeric before evaluating
+                if expr.is_number:
+                    value = float(expr.evalf())
+                    explanation += f". It evaluates to approximately {value:.4f}"
+            except (AttributeError, TypeError, ValueError):
+                 # Handle cases where evalf() fails or is not applicable
+                 pass
+    except Exception as e:
+        print(f"Error explaining SymPy expression '{expr}': {e}")
+        explanation = f"Could not fully explain the expression: {expr}"
+
+    return explanation
+
+def rule_based_explanation(expr_str):
+    """Fallback rule-based explanation when SymPy parsing fails."""
+    explanation = "This expression "
+    ops = []
+    if "+" in expr_str: ops.append("addition")
+    if "-" in expr_str: ops.append("subtraction")
+    if "*" in expr_str: ops.append("multiplication")
+    if "/" in expr_str: ops.append("division")
+    if "**" in expr_str or "^" in expr_str: ops.append("exponentiation")
+    if "sqrt" in expr_str: ops.append("square roots")
+    if any(trig in expr_str for trig in ["sin", "cos", "tan"]): ops.append("trigonometric functions")
+    if any(func in expr_str for func in ["log", "ln", "exp"]): ops.append("logarithmic or exponential functions")
+    if "sum" in expr_str: ops.append("summation")
+    if "int" in expr_str: ops.append("integration")
+    if "lim" in expr_str: ops.append("limits")
+
+    if ops:
+        explanation += "involves " + ", ".join(ops) + "."
+    else:
+        explanation += f"is '{expr_str}'. A detailed automated explanation could not be generated."
+
+    return explanation
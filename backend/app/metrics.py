@@ -0,0 +1,235 @@
+# /app/metrics.py
+# In-process metrics exposed at /metrics in the Prometheus text format. Recording an observation
+# is a lock, a bisect and a few additions, so it is cheap enough for the hot path.
+#
+# Code that runs in the CPU/IO pools records into a per-call buffer (see collect()); the executor
+# ships the buffer back with the call's result and replays it in the server process, labelled
+# with the endpoint that made the call. Counts are per server process.
+
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+from starlette.routing import Match
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Route template of the request (or "/jobs/<kind>" for background jobs) being served
+current_endpoint = contextvars.ContextVar("current_endpoint", default="none")
+
+_local = threading.local()
+REGISTRY = {}
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# --- Metrics ---
+
+REQUEST_SECONDS = Histogram(
+    "stem_http_request_duration_seconds", "Time to serve an HTTP request.", ("endpoint", "method", "status"),
+)
+STAGE_SECONDS = Histogram(
+    "stem_stage_duration_seconds", "Time a pipeline stage call held its slot.", ("stage", "endpoint"),
+)
+STAGE_WAIT_SECONDS = Histogram(
+    "stem_stage_wait_seconds", "Time a call waited for a free slot in a pipeline stage.", ("stage", "endpoint"),
+)
+STAGE_REJECTED = Counter(
+    "stem_stage_rejected_total", "Calls rejected because the stage queue was full.", ("stage",),
+)
+STEP_SECONDS = Histogram(
+    "stem_step_duration_seconds",
+    "Time spent in one processing step (decode, image_open, ocr_preprocess, ocr_layout, ocr_recognize, pdf_page, "
+    "pdf_rasterize, sympy_parse, sympy_evaluate, sympy_sandbox, gemini_payload, gemini_call).",
+    ("step", "endpoint"),
+)
+GEMINI_CALLS = Counter(
+    "stem_gemini_calls_total", "Gemini calls by outcome (ok, error, circuit_open, overloaded).", ("endpoint", "outcome"),
+)
+ANALYSES = Counter(
+    "stem_image_analyses_total", "Image analyses by the engine that produced the answer (ocr = fallback).",
+    ("endpoint", "engine"),
+)
+ANALYSIS_SECONDS = Histogram(
+    "stem_image_analysis_duration_seconds", "Time to analyze an image, by the engine that answered.",
+    ("endpoint", "engine"),
+)
+STAGE_RUNNING = Gauge("stem_stage_running", "Calls currently running in a pipeline stage.", ("stage",))
+STAGE_QUEUE_DEPTH = Gauge("stem_stage_queue_depth", "Calls waiting for a slot in a pipeline stage.", ("stage",))
+CACHE_LOOKUPS = Gauge("stem_cache_lookups", "Result cache lookups by outcome since start.", ("result",))
+CACHE_HIT_RATIO = Gauge("stem_cache_hit_ratio", "Share of result cache lookups that were hits.")
+COALESCED = Gauge(
+    "stem_coalesced_requests", "Requests that computed a result vs joined one already in flight.",
+    ("mode", "role"),
+)
+JOBS = Gauge("stem_jobs", "Background jobs by status.", ("status",))
+CIRCUIT_OPEN = Gauge("stem_gemini_circuit_open", "1 while the Gemini circuit breaker is open or half-open.")
+
+
+def record_step(step, seconds):
+    """Observe a step duration; buffered while inside collect() (i.e. inside a pool call)."""
+    buffer = getattr(_local, "buffer", None)
+    if buffer is not None:
+        buffer.append((step, seconds))
+        return
+    STEP_SECONDS.observe(seconds, step=step, endpoint=current_endpoint.get())
+
+
+@contextlib.contextmanager
+def timed_step(step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_step(step, time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def collect():
+    """Buffer record_step() calls made on this thread; yields the list of (step, seconds)."""
+    previous = getattr(_local, "buffer", None)
+    _local.buffer = buffer = []
+    try:
+        yield buffer
+    finally:
+        _local.buffer = previous
+
+
+def replay(steps):
+    """Record steps collected elsewhere (a worker process, thread or sandbox) in this context."""
+    for step, seconds in steps:
+        record_step(step, seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request and labels work done for it with its route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = route_template(scope)
+        token = current_endpoint.set(endpoint)
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=scope["method"], status=status)
+            current_endpoint.reset(token)
+
+
+def route_template(scope):
+    """The path template ("/jobs/{job_id}") of the route a request will hit, so labels stay low-cardinality."""
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "other"
+
+
+def render():
+    lines = []
+    for metric in REGISTRY.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
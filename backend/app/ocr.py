@@ -0,0 +1,305 @@
+# /app/ocr.py
+# OCR backends used by ocr_image. Each backend takes a preprocessed PIL image and
+# returns (text, confidence, lines) with confidences on Tesseract's 0-100 scale.
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from app import metrics
+from app.config import (
+    DEBUG, OCR_BACKEND, OCR_LANG, OCR_POOL_SIZE, TESSERACT_CMD, OCR_DOWNSCALE, OCR_MAX_PIXELS,
+    OCR_THRESHOLD, OCR_LAYOUT, OCR_LAYOUT_MIN_PIXELS, OCR_REGION_WORKERS,
+)
+from app.images import load_image
+from app.layout import find_regions
+from app.lazy import LazyModule
+from app.preprocess import CROP_MARGIN, estimate_line_height, ink_mask, preprocess_for_ocr
+
+np = LazyModule("numpy")
+pytesseract = LazyModule("pytesseract")
+
+
+def ocr_data_to_text(data):
+    """Rebuild the text layout and confidences from Tesseract's image_to_data output.
+
+    Words are joined with spaces, lines with newlines and paragraphs/blocks with a
+    blank line, which matches what image_to_string would have produced. Returns
+    (text, average word confidence, [(line text, line confidence), ...]).
+    """
+    lines = []  # [(block_key, words, confidences)]
+    current_key = None
+    for i, word in enumerate(data.get('text', [])):
+        word = (word or "").strip()
+        if not word:
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        if key != current_key:
+            lines.append((key, [], []))
+            current_key = key
+        lines[-1][1].append(word)
+        try:
+            conf = float(data['conf'][i])
+        except (TypeError, ValueError):
+            conf = -1.0
+        if conf >= 0:  # Tesseract reports -1 for non-word rows
+            lines[-1][2].append(conf)
+
+    text_parts = []
+    line_results = []
+    all_confs = []
+    previous_key = None
+    for key, words, confs in lines:
+        if previous_key is not None:
+            # New paragraph or block -> blank line, otherwise a plain line break
+            text_parts.append("\n\n" if key[:2] != previous_key[:2] else "\n")
+        line_text = " ".join(words)
+        text_parts.append(line_text)
+        line_results.append((line_text, sum(confs) / len(confs) if confs else None))
+        all_confs.extend(confs)
+        previous_key = key
+
+    confidence = sum(all_confs) / len(all_confs) if all_confs else None
+    return "".join(text_parts), confidence, line_results
+
+
+class PytesseractBackend:
+    """Runs the tesseract command line tool through pytesseract (one process per call)."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang=OCR_LANG):
+        self.lang = lang
+        if TESSERACT_CMD:
+            # Otherwise pytesseract finds `tesseract` on the PATH
+            pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+    def recognize(self, img):
+        data = pytesseract.image_to_data(img, lang=self.lang, output_type=pytesseract.Output.DICT)
+        return ocr_data_to_text(data)
+
+
+class TesserocrPoolBackend:
+    """Keeps a pool of warm, already-initialized tesserocr API handles.
+
+    Each handle loads the traineddata once and is reused for every call, so there
+    is no process start-up or temp-file I/O per image. A call borrows a handle
+    from the pool; handles are opened as concurrent calls need them, up to `size`,
+    after which a call blocks until one is free.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, size=OCR_POOL_SIZE, lang=OCR_LANG):
+        import tesserocr  # Optional dependency, ImportError means "not available"
+
+        self._tesserocr = tesserocr
+        self.size = max(1, size)
+        self.lang = lang
+        self._pool = queue.LifoQueue()  # LIFO keeps the most recently used (hottest) handle busy
+        self._opened = 0
+        self._open_lock = threading.Lock()
+        self._pool.put(self._open())  # Fails here, not on the first call, if tesserocr can't start
+
+    def _open(self):
+        api = self._tesserocr.PyTessBaseAPI(lang=self.lang)
+        self._opened += 1
+        return api
+
+    def _borrow(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            with self._open_lock:
+                if self._opened < self.size:
+                    return self._open()
+            return self._pool.get()
+
+    def recognize(self, img):
+        api = self._borrow()
+        try:
+            api.SetImage(img)
+            api.Recognize()
+            return ocr_data_to_text(self._iterator_to_data(api))
+        finally:
+            api.Clear()
+            self._pool.put(api)
+
+    def _iterator_to_data(self, api):
+        """Convert the word iterator into the same dict layout as pytesseract's image_to_data."""
+        RIL = self._tesserocr.RIL
+        data = {'text': [], 'conf': [], 'block_num': [], 'par_num': [], 'line_num': []}
+        block_num = par_num = line_num = 0
+        for word in self._tesserocr.iterate_level(api.GetIterator(), RIL.WORD):
+            if word.IsAtBeginningOf(RIL.BLOCK):
+                block_num += 1
+                par_num = line_num = 0
+            if word.IsAtBeginningOf(RIL.PARA):
+                par_num += 1
+                line_num = 0
+            if word.IsAtBeginningOf(RIL.TEXTLINE):
+                line_num += 1
+            data['text'].append(word.GetUTF8Text(RIL.WORD))
+            data['conf'].append(word.Confidence(RIL.WORD))
+            data['block_num'].append(block_num)
+            data['par_num'].append(par_num)
+            data['line_num'].append(line_num)
+        return data
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get_nowait().End()
+
+
+class FallbackBackend:
+    """Tries the primary backend and retries with pytesseract if it raises."""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = primary.name
+
+    def recognize(self, img):
+        try:
+            return self.primary.recognize(img)
+        except Exception as e:
+            print(f"Warning: {self.primary.name} OCR failed ({e}). Falling back to {self.fallback.name}.")
+            return self.fallback.recognize(img)
+
+
+def create_ocr_backend(kind=OCR_BACKEND, pool_size=OCR_POOL_SIZE):
+    """Build an OCR backend by name ("auto", "tesserocr" or "pytesseract")."""
+    if kind == "pytesseract":
+        return PytesseractBackend()
+    try:
+        return FallbackBackend(TesserocrPoolBackend(size=pool_size), PytesseractBackend())
+    except Exception as e:
+        if kind == "tesserocr":
+            raise
+        if not isinstance(e, ImportError):
+            print(f"Warning: could not start the tesserocr pool ({e}). Using pytesseract.")
+        return PytesseractBackend()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_ocr_backend():
+    """Return the process-wide OCR backend, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_ocr_backend()
+                print(f"OCR backend: {_backend.name}")
+    return _backend
+
+
+def init_worker_backend():
+    """Create the backend for a worker process of the CPU pool: one handle per region thread."""
+    global _backend
+    with _backend_lock:
+        _backend = create_ocr_backend(pool_size=OCR_REGION_WORKERS)
+
+
+def layout_regions(img):
+    """Crops of the text blocks of a preprocessed page, in reading order, or None to read it whole.
+
+    Small pages and pages without line structure are read in one pass; splitting them would only
+    add Tesseract calls. The split depends only on the page and the settings, never on how many
+    workers are free, so a page always gives the same regions (and cached results stay valid).
+    """
+    if not OCR_LAYOUT or OCR_REGION_WORKERS < 2 or img.width * img.height < OCR_LAYOUT_MIN_PIXELS:
+        return None
+    a = np.asarray(img)
+    mask = a < 128 if OCR_THRESHOLD else ink_mask(a)  # Already binarized by preprocessing unless thresholding is off
+    line_height = estimate_line_height(mask)
+    if line_height is None:
+        return None
+    boxes = find_regions(mask, line_height, max_regions=2 * OCR_REGION_WORKERS)  # Twice the threads evens out uneven blocks
+    if len(boxes) < 2:
+        return None
+    # Keep a white border like the page had; the gaps between blocks are wider than the margin
+    return [img.crop((max(0, left - CROP_MARGIN), max(0, top - CROP_MARGIN),
+                      min(img.width, right + CROP_MARGIN), min(img.height, bottom + CROP_MARGIN)))
+            for left, top, right, bottom in boxes]
+
+
+def recognize_regions(backend, images, workers):
+    """Recognize `images` on up to `workers` threads; results come back in the same order.
+
+    Both backends leave the GIL while Tesseract runs (pytesseract waits on a subprocess,
+    tesserocr releases it around recognition), so the regions really run on separate cores.
+    """
+    workers = min(workers, len(images))
+    if workers < 2:
+        return [backend.recognize(img) for img in images]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-region") as pool:
+        return list(pool.map(backend.recognize, images))
+
+
+def merge_regions(results):
+    """Join per-region (text, confidence, lines) results in reading order.
+
+    Regions are separated by a blank line, like blocks in a single pass. The page confidence is
+    the average over all words, so each region counts by its number of words.
+    """
+    texts, lines, regions = [], [], []
+    weighted, words = 0.0, 0
+    for text, confidence, region_lines in results:
+        text = text.strip()
+        if not text:
+            continue
+        texts.append(text)
+        lines.extend(region_lines)
+        regions.append((text, confidence))
+        if confidence is not None:
+            count = len(text.split())
+            weighted += confidence * count
+            words += count
+    return "\n\n".join(texts), weighted / words if words else None, lines, regions
+
+
+def ocr_image_lines(image_data, workers=1):
+    """Process an image (bytes or an Upload) with Tesseract OCR.
+
+    A large page is split into text blocks, which are recognized in parallel on `workers` threads
+    (at most OCR_REGION_WORKERS) or one after the other with a single worker.
+    Returns (text, confidence, lines, regions) where lines and regions are [(text, confidence)]
+    in reading order and confidences are Tesseract's 0-100 scale.
+    """
+    try:
+        with metrics.timed_step("image_open"):
+            # Preprocessing would shrink the image to OCR_MAX_PIXELS anyway, so never decode more than that
+            img, _ = load_image(image_data, max_pixels=OCR_MAX_PIXELS if OCR_DOWNSCALE else None, mode="L")
+
+        # Preprocess the image for better OCR (grayscale, downscale, threshold, crop, deskew)
+        with metrics.timed_step("ocr_preprocess"):
+            img, timings = preprocess_for_ocr(img)
+        if DEBUG:
+            print("OCR preprocessing: " + ", ".join(f"{step} {seconds * 1000:.1f} ms" for step, seconds in timings.items())
+                  + f" -> {img.width}x{img.height}")
+
+        with metrics.timed_step("ocr_layout"):
+            regions = layout_regions(img)
+        if DEBUG and regions:
+            print(f"OCR layout: {len(regions)} regions")
+
+        # One engine run per region gives us both the words (with layout) and their confidences
+        with metrics.timed_step("ocr_recognize"):
+            results = recognize_regions(get_ocr_backend(), regions or [img], min(workers, OCR_REGION_WORKERS))
+
+        return merge_regions(results)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OCR processing error: {str(e)}")
+
+
+def ocr_image(image_data, workers=1):
+    """Process an image with Tesseract OCR."""
+    text, confidence, _, _ = ocr_image_lines(image_data, workers)
+    return text, confidence
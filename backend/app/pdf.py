@@ -0,0 +1,242 @@
+# /app/pdf.py
+# PDF text extraction with PyMuPDF.
+
+import asyncio
+import os
+import tempfile
+
+from fastapi import HTTPException
+
+from app import metrics
+from app.config import (
+    CPU_WORKERS, PDF_PARALLEL_MIN_BYTES, PDF_PARALLEL_MIN_PAGES, PDF_PAGES_PER_WORKER, PDF_OCR_ENABLED, PDF_OCR_DPI,
+    PDF_STREAM_PAGES, OCR_REGION_WORKERS,
+)
+from app.executor import STAGES, run_stage, run_stage_wide
+from app.lazy import LazyModule
+from app.ocr import ocr_image
+from app.uploads import as_upload
+
+fitz = LazyModule("fitz")  # PyMuPDF
+
+
+def open_pdf(pdf_data):
+    """Open a PDF from a path, bytes or an Upload, turning parse failures into a 500 response.
+
+    A spooled upload is opened by path, so MuPDF reads it from disk as needed. On POSIX systems
+    the open document stays readable after the upload's temp file has been removed.
+    """
+    if isinstance(pdf_data, str):
+        return open_pdf_path(pdf_data)
+    upload = as_upload(pdf_data)
+    if upload.path is not None:
+        return open_pdf_path(upload.path)
+    try:
+        return fitz.open(stream=upload.data, filetype="pdf")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"PDF processing error: {str(e)}")
+
+
+def iter_pdf_pages(doc):
+    """Yield (page_number, text) one page at a time; page numbers start at 1."""
+    for index, page in enumerate(doc):
+        with metrics.timed_step("pdf_page"):
+            text = page.get_text()
+        yield index + 1, text
+
+
+def extract_pdf_pages(pdf_data):
+    """Return the text layer of every page of a PDF as a list."""
+    doc = open_pdf(pdf_data)
+    try:
+        return [text for _, text in iter_pdf_pages(doc)]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"PDF processing error: {str(e)}")
+    finally:
+        doc.close()
+
+
+def extract_pdf_text(pdf_data):
+    """Extract text from a PDF file."""
+    # Collect page texts and join once instead of repeated string concatenation
+    texts = extract_pdf_pages(pdf_data)
+    return {
+        "content": "".join(texts),
+        "pages": len(texts)
+    }
+
+
+# --- Parallel extraction for large documents ---
+# Each worker opens the upload's spooled file by path (an in-memory upload is written to a temp file
+# first). MuPDF reads it lazily and the OS page cache is shared, so no worker receives a copy of the bytes.
+# The functions below also take an Upload: a spooled one pickles as just its path.
+
+def open_pdf_path(path):
+    try:
+        return fitz.open(path, filetype="pdf")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"PDF processing error: {str(e)}")
+
+
+def pdf_page_count(path):
+    doc = open_pdf(path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def extract_pdf_page_range(path, start, stop):
+    """Return the texts of pages [start, stop) of the PDF at `path`."""
+    doc = open_pdf(path)
+    try:
+        texts = []
+        for index in range(start, stop):
+            with metrics.timed_step("pdf_page"):
+                texts.append(doc[index].get_text())
+        return texts
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"PDF processing error: {str(e)}")
+    finally:
+        doc.close()
+
+
+def plan_page_ranges(page_count, workers=CPU_WORKERS, min_pages=PDF_PARALLEL_MIN_PAGES,
+                     pages_per_worker=PDF_PAGES_PER_WORKER):
+    """Split [0, page_count) into contiguous ranges, one per worker that has enough pages to do."""
+    if page_count < min_pages:
+        chunks = 1
+    else:
+        chunks = max(1, min(workers, page_count // max(1, pages_per_worker)))
+    size, extra = divmod(page_count, chunks)
+    ranges = []
+    start = 0
+    for i in range(chunks):
+        stop = start + size + (1 if i < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def write_temp_pdf(pdf_data):
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as f, as_upload(pdf_data).view() as view:
+        f.write(view)
+    return path
+
+
+def rasterize_pdf_page(path, index, dpi=PDF_OCR_DPI):
+    """Render one page of the PDF at `path` to a grayscale PGM image for OCR."""
+    doc = open_pdf_path(path)
+    try:
+        with metrics.timed_step("pdf_rasterize"):
+            pix = doc[index].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            return pix.tobytes("pgm")  # Uncompressed, so no time is spent encoding
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"PDF processing error: {str(e)}")
+    finally:
+        doc.close()
+
+
+def ocr_pdf_page_sync(path, index, workers=1):
+    """Rasterize a page and recognize it in the same worker, so the rendered page never leaves it."""
+    return ocr_image(rasterize_pdf_page(path, index), workers)
+
+
+async def ocr_pdf_page(path, index):
+    """Rasterize and recognize one page in the ocr stage."""
+    return await run_stage_wide("ocr", ocr_pdf_page_sync, OCR_REGION_WORKERS, path, index)
+
+
+async def stream_pdf_pages(pdf_data, page_count, pages_per_call=PDF_STREAM_PAGES):
+    """Yield (page_number, text) for every page, extracting `pages_per_call` pages per pdf stage call.
+
+    The next range is extracted while the current one is sent, and only those two are held in memory.
+    Count the pages first with run_stage("pdf", pdf_page_count, upload), so a broken PDF fails
+    before anything is streamed.
+    """
+    upload = as_upload(pdf_data)
+    ranges = [(start, min(start + pages_per_call, page_count)) for start in range(0, page_count, pages_per_call)]
+    pending = None
+    try:
+        for i, (start, stop) in enumerate(ranges):
+            texts = await (pending or run_stage("pdf", extract_pdf_page_range, upload, start, stop))
+            pending = None
+            if i + 1 < len(ranges):
+                pending = asyncio.ensure_future(run_stage("pdf", extract_pdf_page_range, upload, *ranges[i + 1]))
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
+    finally:
+        if pending is not None:
+            pending.cancel()  # The client went away mid-stream
+
+
+async def extract_pdf_document(pdf_data, progress=None):
+    """Extract a PDF's text, using the CPU pool for large files and OCR for scanned pages.
+
+    Large PDFs are extracted in page ranges across the pool and merged in page order. Pages
+    without a text layer are rasterized and OCR'd, each page as one task in the ocr stage. Only
+    as many pages as the stage runs at once are in flight, so a long scanned document neither
+    fills the stage's wait queue by itself nor piles up rendered pages.
+
+    `progress(**fields)`, if given, is called with `pages`/`pages_done` as text extraction
+    advances and `ocr_pages`/`ocr_pages_done` while scanned pages are OCR'd.
+    """
+    progress = progress or (lambda **fields: None)
+    upload = as_upload(pdf_data)
+    path = upload.path
+    temp_path = None
+    try:
+        if upload.size < PDF_PARALLEL_MIN_BYTES or CPU_WORKERS < 2:
+            texts = await run_stage("pdf", extract_pdf_pages, upload)
+        else:
+            if path is None:
+                path = temp_path = await asyncio.to_thread(write_temp_pdf, upload)
+            page_count = await run_stage("pdf", pdf_page_count, path)
+            progress(pages=page_count, pages_done=0)
+            done = 0
+
+            async def extract_range(start, stop):
+                nonlocal done
+                chunk = await run_stage("pdf", extract_pdf_page_range, path, start, stop)
+                done += len(chunk)
+                progress(pages_done=done)
+                return chunk
+
+            chunks = await asyncio.gather(*[extract_range(start, stop) for start, stop in plan_page_ranges(page_count)])
+            texts = [text for chunk in chunks for text in chunk]
+        progress(pages=len(texts), pages_done=len(texts))
+
+        ocr_pages = []
+        scanned = [index for index, text in enumerate(texts) if not text.strip()]
+        if scanned and PDF_OCR_ENABLED:
+            if path is None:
+                path = temp_path = await asyncio.to_thread(write_temp_pdf, upload)
+            progress(ocr_pages=len(scanned), ocr_pages_done=0)
+            ocr_done = 0
+            limit = asyncio.Semaphore(STAGES["ocr"].concurrency)
+
+            async def ocr_page(index):
+                nonlocal ocr_done
+                async with limit:
+                    result = await ocr_pdf_page(path, index)
+                ocr_done += 1
+                progress(ocr_pages_done=ocr_done)
+                return result
+
+            results = await asyncio.gather(*[ocr_page(index) for index in scanned])
+            for index, (text, confidence) in zip(scanned, results):
+                texts[index] = text + "\n" if text else ""
+                ocr_pages.append({
+                    "page": index + 1,
+                    "confidence": confidence / 100.0 if confidence is not None else None,
+                })
+
+        return {
+            "content": "".join(texts),
+            "pages": len(texts),
+            "ocr_pages": ocr_pages,
+        }
+    finally:
+        if temp_path is not None:
+            os.remove(temp_path)
@@ -0,0 +1,103 @@
+# /app/sandbox.py
+# Killable worker processes for code that may run for an unbounded time (e.g. SymPy on
+# hostile input). Unlike a ProcessPoolExecutor job, a call that exceeds its timeout kills
+# its worker outright; a fresh worker takes its place.
+
+import multiprocessing
+import queue
+import threading
+
+from app.lazy import wait_for_warm_up
+from app.serving import prepare_child_process
+
+
+class SandboxTimeout(Exception):
+    """The call did not finish within its wall-clock timeout and its worker was killed."""
+
+
+class SandboxCrashed(RuntimeError):
+    """The worker died during the call (e.g. killed for running out of memory); it has been replaced."""
+
+
+def _sandbox_main(conn):
+    prepare_child_process()
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, fn(*args)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class _SandboxWorker:
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        # Fork only once the heavy imports are done (see app/lazy.py); the child inherits SymPy ready to use
+        wait_for_warm_up()
+        self.process = multiprocessing.Process(target=_sandbox_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """A fixed number of sandbox processes, started on first use."""
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+        self.kills = 0
+
+    def _ensure_started(self):
+        if not self._started:
+            with self._lock:
+                if not self._started:
+                    for _ in range(self.size):
+                        self._idle.put(_SandboxWorker())
+                    self._started = True
+
+    def run(self, fn, *args, timeout):
+        """Call fn(*args) in a sandbox process; raise SandboxTimeout after `timeout` seconds.
+
+        Waiting for a free sandbox is bounded by `timeout` as well. `fn` must be a module-level
+        function. Exceptions inside the sandbox come back as RuntimeError; SandboxCrashed (a
+        subclass) means the worker itself died.
+        """
+        self._ensure_started()
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise SandboxTimeout(f"found no free sandbox within {timeout} seconds") from None
+        try:
+            worker.conn.send((fn, args))
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                worker = _SandboxWorker()
+                self.kills += 1
+                raise SandboxTimeout(f"timed out after {timeout} seconds")
+            ok, value = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # The worker died (e.g. out of memory); replace it
+            worker.kill()
+            worker = _SandboxWorker()
+            raise SandboxCrashed(f"Sandbox worker crashed: {e}")
+        finally:
+            self._idle.put(worker)
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    def shutdown(self):
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get_nowait().kill()
+            self._started = False
@@ -0,0 +1,110 @@
+# /app/serving.py
+# Process sizing and hygiene for production serving (gunicorn.conf.py). Sizes are worked out
+# from the cores this container may actually use, so Gunicorn workers, their CPU pools and
+# Tesseract's own threads add up to the machine instead of oversubscribing it. Worker pool
+# processes also detach from the server: they drop its listening sockets and exit with their parent.
+# Nothing here imports the rest of the app; app/config.py uses it to pick its defaults.
+
+import math
+import os
+import socket
+import stat
+import threading
+import time
+
+MAX_WEB_WORKERS = 4  # More event loops add pools (and memory) faster than they add throughput
+
+
+def available_cpus():
+    """Cores this process may use: its CPU affinity, capped by a cgroup CPU quota (docker --cpus)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def _cgroup_cpu_quota():
+    try:  # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:  # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def ocr_slots(cpus, ocr_threads):
+    """Tesseract calls the machine can run side by side when each uses `ocr_threads` threads."""
+    return max(1, cpus // max(1, ocr_threads))
+
+
+def default_web_workers(cpus, ocr_threads):
+    """One Gunicorn worker per two Tesseract slots, between 1 and MAX_WEB_WORKERS.
+
+    The event loops themselves need little CPU (the real work runs in each worker's pools), so
+    a few workers are enough to spread request parsing and survive a worker restart.
+    """
+    return max(1, min(MAX_WEB_WORKERS, ocr_slots(cpus, ocr_threads) // 2))
+
+
+def pool_size(cpus, ocr_threads, web_workers):
+    """CPU pool processes per server process: an equal share of the machine's Tesseract slots."""
+    return max(1, ocr_slots(cpus, ocr_threads) // max(1, web_workers))
+
+
+# --- Pool and sandbox processes ---
+
+def close_listening_sockets():
+    """Close listening sockets inherited from the server process (Linux only).
+
+    A forked pool process never accepts connections, but as long as it holds the server's
+    socket the kernel keeps queueing connections on it, even after the server has exited.
+    """
+    try:
+        fds = [int(name) for name in os.listdir("/proc/self/fd")]
+    except OSError:
+        return
+    for fd in fds:
+        try:
+            if not stat.S_ISSOCK(os.fstat(fd).st_mode):
+                continue
+            sock = socket.socket(fileno=fd)
+        except OSError:
+            continue
+        try:
+            listening = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN)
+        except OSError:
+            listening = 0
+        if listening:
+            sock.close()
+        else:
+            sock.detach()  # Leave other sockets (e.g. pipes to the parent) open
+
+
+def exit_with_parent(interval=1.0):
+    """Exit this process within `interval` seconds of its parent going away (e.g. a worker killed by Gunicorn)."""
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(interval)
+        os._exit(1)
+
+    threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+
+
+def prepare_child_process():
+    """Called first thing in every forked pool and sandbox process."""
+    close_listening_sockets()
+    exit_with_parent()
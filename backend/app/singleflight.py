@@ -0,0 +1,67 @@
+# /app/singleflight.py
+# In-flight request coalescing. When identical uploads arrive together (a whole class
+# uploading the same worksheet), only the first one runs OCR/Gemini; the rest wait on its
+# result. Unlike the result cache this only lasts while the computation is running.
+
+import asyncio
+from collections import Counter
+
+
+class _Flight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Share one running computation between all concurrent callers with the same key."""
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = Counter()  # Computations actually started, per mode
+        self.coalesced = Counter()  # Callers that joined a computation already in flight, per mode
+
+    async def do(self, key, compute, mode=""):
+        """Await compute() once per key at a time; concurrent callers get the same result or exception.
+
+        The computation runs as its own task, so one caller disconnecting doesn't fail the others.
+        It is cancelled only when every caller waiting on it has gone away.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(compute()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.leaders[mode] += 1
+        else:
+            self.coalesced[mode] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def snapshot(self):
+        leaders, coalesced = sum(self.leaders.values()), sum(self.coalesced.values())
+        return {
+            "in_flight": len(self._flights),
+            "computed": leaders,
+            "coalesced": coalesced,
+            "coalesced_rate": coalesced / (leaders + coalesced) if leaders + coalesced else 0.0,
+            "by_mode": {
+                mode: {"computed": self.leaders[mode], "coalesced": self.coalesced[mode]}
+                for mode in sorted(set(self.leaders) | set(self.coalesced))
+            },
+        }
+
+
+in_flight = SingleFlight()
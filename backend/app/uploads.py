@@ -0,0 +1,261 @@
+# /app/uploads.py
+# Memory-bounded upload ingestion. Uploads are read in chunks, size-checked and hashed as they
+# arrive; small ones stay in memory and larger ones are spooled to a temp file that PIL reads
+# through mmap and PyMuPDF opens by path. The resulting Upload is what flows through the
+# pipeline: it pickles as its path, so pool workers map the same file instead of receiving a copy.
+
+import asyncio
+import base64
+import contextlib
+import hashlib
+import io
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import uuid
+import weakref
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from app.config import UPLOAD_MAX_BYTES, PDF_UPLOAD_MAX_BYTES, UPLOAD_SPOOL_BYTES, UPLOAD_DIR, UPLOAD_CHUNK_BYTES
+
+# Whole request bodies are capped a little above the largest upload limit (base64 JSON is 4/3 the size,
+# multipart adds a few headers), so an oversized upload is cut off before it is spooled
+REQUEST_MAX_BYTES = max(UPLOAD_MAX_BYTES * 4 // 3, PDF_UPLOAD_MAX_BYTES) + 64 * 1024
+
+BASE64_CHUNK_CHARS = 4 * 64 * 1024
+_NOT_BASE64 = re.compile(r"[^A-Za-z0-9+/=]")  # Discarded like base64.b64decode does
+
+
+class UploadTooLarge(HTTPException):
+    """Raised as soon as an upload (or request body) grows past its size limit."""
+
+    def __init__(self, limit):
+        super().__init__(status_code=413, detail=f"Upload is too large (the limit is {limit} bytes)")
+
+
+class Upload:
+    """An uploaded file: bytes in memory when small, a spooled temp file when large.
+
+    Use `open()` for a file object (PIL, PyMuPDF) and `view()` for a memoryview of the
+    contents; neither copies a spooled file into memory. `digest` is the SHA-256 of the
+    contents. A spooled file is removed once the last reference to its Upload goes away.
+    """
+
+    def __init__(self, data=None, path=None, size=None, digest=None):
+        self.data = data
+        self.path = path
+        self.size = len(data) if data is not None else size
+        self._digest = digest
+        self._cleanup = None
+
+    @classmethod
+    def spooled(cls, path, size, digest=None):
+        """Take ownership of the temp file at `path`."""
+        upload = cls(path=path, size=size, digest=digest)
+        upload._cleanup = weakref.finalize(upload, _remove, path)
+        return upload
+
+    @classmethod
+    def from_path(cls, path):
+        """An Upload of an existing file, which may be removed while the Upload is still in use.
+
+        Small files are read into memory; larger ones are hard-linked (or copied) into the spool directory.
+        """
+        size = os.path.getsize(path)
+        if size <= UPLOAD_SPOOL_BYTES:
+            with open(path, "rb") as f:
+                return cls(f.read())
+        spool_path = os.path.join(UPLOAD_DIR or tempfile.gettempdir(), f"upload-{uuid.uuid4().hex}")
+        _link_or_copy(path, spool_path)
+        return cls.spooled(spool_path, size, file_digest(spool_path))
+
+    def __len__(self):
+        return self.size
+
+    def __getstate__(self):
+        # Copies sent to worker processes share the file but never remove it
+        return {**self.__dict__, "_cleanup": None}
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            with self.view() as view:
+                self._digest = hashlib.sha256(view).digest()
+        return self._digest
+
+    @contextlib.contextmanager
+    def open(self):
+        """A read-only, seekable file object over the contents, valid inside the `with` block."""
+        if self.path is None:
+            yield io.BytesIO(self.data)  # Shares the bytes object rather than copying it
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+    @contextlib.contextmanager
+    def view(self):
+        """A memoryview of the contents, valid inside the `with` block."""
+        if self.path is None:
+            yield memoryview(self.data)
+            return
+        with self.open() as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+    def save(self, path):
+        """Write the contents to `path` (a hard link when the upload is already on disk)."""
+        if self.path is None:
+            with open(path, "wb") as f:
+                f.write(self.data)
+        else:
+            _link_or_copy(self.path, path)
+
+    def __repr__(self):
+        where = f"spooled at {self.path}" if self.path else "in memory"
+        return f"<Upload {self.size} bytes, {where}>"
+
+
+def as_upload(data):
+    """Wrap raw bytes as an Upload (without copying them); Uploads are returned unchanged."""
+    return data if isinstance(data, Upload) else Upload(data)
+
+
+def file_digest(path, chunk_size=UPLOAD_CHUNK_BYTES):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:  # Different filesystem, or links not supported
+        shutil.copyfile(source, destination)
+
+
+class _Spool:
+    """Collects an upload chunk by chunk, moving it to a temp file once it outgrows UPLOAD_SPOOL_BYTES."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.chunks = []
+        self.file = None
+        self.digest = hashlib.sha256()
+
+    def fits_in_memory(self, extra):
+        return self.file is None and self.size + extra <= UPLOAD_SPOOL_BYTES
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.limit:
+            raise UploadTooLarge(self.limit)
+        self.digest.update(chunk)
+        if self.file is None and self.size <= UPLOAD_SPOOL_BYTES:
+            self.chunks.append(chunk)
+            return
+        if self.file is None:
+            self.file = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix="upload-", delete=False)
+            self.file.writelines(self.chunks)
+            self.chunks = []
+        self.file.write(chunk)
+
+    def finish(self):
+        if self.file is None:
+            return Upload(b"".join(self.chunks), digest=self.digest.digest())
+        self.file.close()
+        return Upload.spooled(self.file.name, self.size, self.digest.digest())
+
+    def discard(self):
+        self.chunks = []
+        if self.file is not None:
+            self.file.close()
+            _remove(self.file.name)
+
+
+async def ingest(file, limit=UPLOAD_MAX_BYTES, chunk_size=UPLOAD_CHUNK_BYTES):
+    """Read a FastAPI UploadFile into an Upload, raising UploadTooLarge once it passes `limit` bytes."""
+    if getattr(file, "size", None) is not None and file.size > limit:
+        raise UploadTooLarge(limit)
+    spool = _Spool(limit)
+    try:
+        while chunk := await file.read(chunk_size):
+            if spool.fits_in_memory(len(chunk)):
+                spool.write(chunk)
+            else:
+                await asyncio.to_thread(spool.write, chunk)  # Disk writes stay off the event loop
+        return spool.finish()
+    except BaseException:
+        spool.discard()
+        raise
+
+
+def decode_base64(text, limit=UPLOAD_MAX_BYTES, chunk_chars=BASE64_CHUNK_CHARS):
+    """Decode a base64 string into an Upload a chunk at a time, so the decoded bytes are never
+    held in memory alongside the encoded string. Raises binascii.Error for invalid input."""
+    spool = _Spool(limit)
+    try:
+        pending = ""
+        for start in range(0, len(text), chunk_chars):
+            piece = pending + _NOT_BASE64.sub("", text[start:start + chunk_chars])
+            usable = len(piece) - len(piece) % 4
+            pending = piece[usable:]
+            if usable:
+                spool.write(base64.b64decode(piece[:usable]))
+        if pending:
+            spool.write(base64.b64decode(pending))  # Incomplete final quantum: raises "Incorrect padding"
+        return spool.finish()
+    except BaseException:
+        spool.discard()
+        raise
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware that caps request bodies at `max_bytes` while they stream in.
+
+    A Content-Length over the cap is answered with 413 before any of the body is read; bodies
+    sent without one are counted as they arrive and cut off once they cross it.
+    """
+
+    def __init__(self, app, max_bytes=REQUEST_MAX_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            error = UploadTooLarge(self.max_bytes)
+            await JSONResponse({"detail": error.detail}, status_code=error.status_code)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadTooLarge(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
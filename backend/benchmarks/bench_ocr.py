@@ -0,0 +1,89 @@
+"""
+Compare per-image latency and throughput of the OCR backends.
+Usage: python -m benchmarks.bench_ocr [--images 20] [--concurrency 4] [--preprocess]
+With --preprocess the images go through app.preprocess first, as they do in the API.
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from app.ocr import PytesseractBackend, TesserocrPoolBackend
+from app.preprocess import preprocess_for_ocr
+
+SAMPLE_LINES = [
+    "Solve for x: 3x + 7 = 22",
+    "The quadratic formula is x = (-b +- sqrt(b^2 - 4ac)) / 2a",
+    "Find the derivative of f(x) = x^3 - 2x + 1",
+    "Area of a circle: A = pi r^2",
+]
+
+
+def make_image(index, width=1200, height=400):
+    """Draw a few lines of worksheet-style text on a white grayscale image."""
+    img = Image.new("L", (width, height), color=255)
+    draw = ImageDraw.Draw(img)
+    for row in range(len(SAMPLE_LINES)):
+        line = SAMPLE_LINES[(index + row) % len(SAMPLE_LINES)]
+        draw.text((40, 40 + row * 80), line, fill=0)
+    return img.resize((width * 2, height * 2))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def run_backend(backend, images, concurrency):
+    # Warm-up call so one-time initialization is not counted
+    backend.recognize(images[0])
+
+    latencies = []
+    for img in images:
+        start = time.perf_counter()
+        backend.recognize(img)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(backend.recognize, images))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n--- {backend.name} ---")
+    print(f"Sequential latency: mean {statistics.mean(latencies) * 1000:.1f} ms, "
+          f"p50 {percentile(latencies, 50) * 1000:.1f} ms, p95 {percentile(latencies, 95) * 1000:.1f} ms")
+    print(f"Throughput with {concurrency} workers: {len(images) / elapsed:.2f} images/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--preprocess", action="store_true", help="Downscale/threshold/crop/deskew images first")
+    args = parser.parse_args()
+
+    images = [make_image(i) for i in range(args.images)]
+    if args.preprocess:
+        start = time.perf_counter()
+        images = [preprocess_for_ocr(img)[0] for img in images]
+        print(f"Preprocessing: {(time.perf_counter() - start) / len(images) * 1000:.1f} ms per image, "
+              f"{images[0].width}x{images[0].height} px after")
+
+    run_backend(PytesseractBackend(), images, args.concurrency)
+    try:
+        backend = TesserocrPoolBackend(size=args.concurrency)
+    except Exception as e:
+        print(f"\nSkipping tesserocr pool: {e}")
+        return
+    try:
+        run_backend(backend, images, args.concurrency)
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measure how PDF text extraction scales with the number of worker processes.
+Usage: python -m benchmarks.bench_pdf [--pages 400] [--repeat 3]
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+from app.pdf import write_temp_pdf, extract_pdf_page_range, extract_pdf_text, plan_page_ranges
+
+PARAGRAPH = (
+    "The derivative of a function measures how its output changes as its input changes. "
+    "For f(x) = x^2 the derivative is f'(x) = 2x, so the slope of the tangent line grows with x. "
+)
+
+
+def make_pdf(pages):
+    """Build a text PDF with a few dense paragraphs on every page."""
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {number + 1}\n" + PARAGRAPH * 12, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def time_parallel(path, page_count, workers, repeat):
+    ranges = plan_page_ranges(page_count, workers=workers, min_pages=0, pages_per_worker=1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(pdf_warmup, range(workers)))  # Start the processes before timing
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            futures = [executor.submit(extract_pdf_page_range, path, a, b) for a, b in ranges]
+            texts = [text for future in futures for text in future.result()]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best, len(texts)
+
+
+def pdf_warmup(_):
+    return os.getpid()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pdf_data = make_pdf(args.pages)
+    print(f"Generated {args.pages}-page PDF ({len(pdf_data) / 1024:.0f} KiB)")
+
+    start = time.perf_counter()
+    extract_pdf_text(pdf_data)
+    baseline = time.perf_counter() - start
+    print(f"\nSingle-process extract_pdf_text: {baseline * 1000:.1f} ms")
+
+    path = write_temp_pdf(pdf_data)
+    try:
+        cores = os.cpu_count() or 1
+        workers = 1
+        print(f"\n{'workers':>8} {'time (ms)':>10} {'pages/s':>9} {'speedup':>8}")
+        while workers <= cores:
+            elapsed, pages = time_parallel(path, args.pages, workers, args.repeat)
+            print(f"{workers:>8} {elapsed * 1000:>10.1f} {pages / elapsed:>9.0f} {baseline / elapsed:>8.2f}")
+            workers *= 2
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Synthetic inputs for the benchmarks: equation images at several resolutions, text and scanned
+PDFs, and an expression corpus. Everything is generated from a seed, so runs are reproducible.
+Usage: python -m benchmarks.fixtures --out fixtures/  (writes the files to look at them)
+"""
+
+import argparse
+import io
+import os
+import random
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageFont
+
+# (name, width, height): a small crop, a typical upload and a full-resolution phone photo
+IMAGE_SIZES = [("small", 640, 480), ("medium", 1600, 1200), ("photo", 4000, 3000)]
+
+EQUATIONS = [
+    "3x + 7 = 22",
+    "x = (-b +- sqrt(b^2 - 4ac)) / 2a",
+    "f(x) = x^3 - 2x + 1",
+    "A = pi r^2",
+    "E = m c^2",
+    "a^2 + b^2 = c^2",
+    "y = 2x^2 - 4x + 3",
+    "sin^2(t) + cos^2(t) = 1",
+]
+
+# (expression, format) pairs in the shape /explain accepts
+EXPRESSIONS = [
+    ("x^2 + 2x + 1", "latex"),
+    ("\\frac{a}{b} + \\frac{c}{d}", "latex"),
+    ("\\sqrt{x^2 + y^2}", "latex"),
+    ("\\sin(x)^2 + \\cos(x)^2", "latex"),
+    ("e^{i \\pi} + 1", "latex"),
+    ("\\frac{d}{dx} x^3", "latex"),
+    ("(x + 1)*(x - 1)", "plain"),
+    ("2*x + 3*y - 7", "plain"),
+    ("x**3 - 6*x**2 + 11*x - 6", "plain"),
+    ("log(x) + exp(x)", "plain"),
+    ("sqrt(2)/2", "plain"),
+    ("a*b + b*c + c*a", "plain"),
+]
+
+PARAGRAPH = (
+    "The derivative of a function measures how its output changes as its input changes. "
+    "For f(x) = x^2 the derivative is f'(x) = 2x, so the slope of the tangent line grows with x. "
+)
+
+
+def equation_image(index, width, height, seed=0):
+    """PNG of a few handwritten-worksheet-style equation lines, slightly rotated, at width x height."""
+    rng = random.Random(seed * 1000 + index)
+    font = ImageFont.load_default(size=max(12, height // 12))
+    img = Image.new("L", (width, height), color=rng.randint(225, 250))
+    draw = ImageDraw.Draw(img)
+    for row in range(3):
+        line = EQUATIONS[(index + row) % len(EQUATIONS)]
+        draw.text((width // 12, height // 8 + row * height // 4), line, fill=rng.randint(0, 40), font=font)
+    img = img.rotate(rng.uniform(-3, 3), resample=Image.BICUBIC, fillcolor=235)
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def plot_image(index, width=1200, height=900, seed=0):
+    """PNG of a labelled line plot."""
+    rng = random.Random(seed * 1000 + index)
+    font = ImageFont.load_default(size=max(12, height // 30))
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    left, bottom = width // 10, height * 9 // 10
+    draw.line([(left, height // 10), (left, bottom), (width * 9 // 10, bottom)], fill="black", width=3)
+    a = rng.uniform(0.5, 2.0)
+    points = [(left + x, bottom - int(a * x * x * (bottom - height // 10) / (width * 0.8) ** 2))
+              for x in range(0, int(width * 0.8), 10)]
+    draw.line(points, fill="blue", width=4)
+    draw.text((width // 2, bottom + 20), "x", fill="black", font=font)
+    draw.text((left - 40, height // 2), "y", fill="black", font=font)
+    draw.text((width // 3, height // 20), f"y = {a:.1f} x^2", fill="black", font=font)
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def text_pdf(pages, seed=0):
+    """PDF with a text layer on every page."""
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {number + 1} ({seed})\n" + PARAGRAPH * 12, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def scanned_pdf(pages, seed=0):
+    """PDF whose pages are images only (no text layer), so extraction has to OCR them."""
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        scan = equation_image(seed * 100 + number, 1700, 2200, seed=seed)
+        page.insert_image(page.rect, stream=scan)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def build(variants=8, pdf_pages=20, scanned_pages=4, seed=0):
+    """All fixtures, keyed by name. Every kind gets `variants` distinct inputs, so concurrent
+    requests for the "same" fixture don't coalesce into one computation."""
+    fixtures = {
+        f"image_{name}": [equation_image(i, width, height, seed) for i in range(variants)]
+        for name, width, height in IMAGE_SIZES
+    }
+    fixtures["plot"] = [plot_image(i, seed=seed) for i in range(variants)]
+    fixtures["pdf_text"] = [text_pdf(pdf_pages, seed=seed * 100 + i) for i in range(variants)]
+    fixtures["pdf_scanned"] = [scanned_pdf(scanned_pages, seed=seed * 100 + i) for i in range(variants)]
+    fixtures["expressions"] = list(EXPRESSIONS)
+    return fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--out", default="fixtures")
+    parser.add_argument("--variants", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for name, items in build(args.variants, seed=args.seed).items():
+        if name == "expressions":
+            continue
+        extension = "pdf" if name.startswith("pdf") else "png"
+        for i, data in enumerate(items):
+            path = os.path.join(args.out, f"{name}_{i}.{extension}")
+            with open(path, "wb") as f:
+                f.write(data)
+            print(f"{path}: {len(data) / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Local stand-in for the Gemini REST API that replays canned responses with configurable latency.
+Usage: python -m benchmarks.gemini_stub [--port 8081] [--latency 0.5] [--responses canned.json]
+Then start the API with GEMINI_API_BASE=http://localhost:8081 and any GOOGLE_API_KEY.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSES = [
+    "This equation is the quadratic formula. It gives the two solutions of a x squared plus b x plus c "
+    "equals zero.\nLaTeX: x = \\frac{-b \\pm \\sqrt{b^2 - 4ac}}{2a}",
+    "This is a line graph of y equals x squared. The horizontal axis is x and the vertical axis is y. "
+    "The curve is a parabola with its lowest point at the origin and it rises on both sides.",
+]
+
+
+def gemini_payload(text):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+class GeminiStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, responses=None):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self._responses = itertools.cycle(responses or DEFAULT_RESPONSES)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()  # Client (host, port) pairs, to check connection reuse
+
+    def next_text(self):
+        with self._lock:
+            self.requests += 1
+            return next(self._responses)
+
+    def delay(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path.split("?")[0].startswith("/v1beta/models/"):
+            name = self.path.split("?")[0][len("/v1beta/"):]
+            self._send_json(200, {"name": name})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        path = self.path.split("?")[0]
+        if path.endswith(":generateContent"):
+            text = self.server.next_text()
+            self.server.delay()
+            self._send_json(200, gemini_payload(text))
+        elif path.endswith(":streamGenerateContent"):
+            self._stream(self.server.next_text())
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def _stream(self, text, chunk_words=8):
+        """Send the text as server-sent events, a few words per event, spread over the latency."""
+        words = text.split(" ")
+        chunks = [" ".join(words[i:i + chunk_words]) + " " for i in range(0, len(words), chunk_words)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        self.server.delay()  # Time to first token
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(gemini_payload(chunk))}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.latency / max(1, len(chunks)))
+
+
+def start_stub(port=0, latency=0.0, jitter=0.0, responses=None):
+    """Start a stub server on a background thread; call .shutdown() on the result to stop it."""
+    server = GeminiStub(("127.0.0.1", port), latency=latency, jitter=jitter, responses=responses)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency")
+    parser.add_argument("--responses", help="JSON file with a list of response texts to replay")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, "r", encoding="utf-8") as f:
+            responses = json.load(f)
+
+    server = GeminiStub(("127.0.0.1", args.port), latency=args.latency, jitter=args.jitter, responses=responses)
+    print(f"Gemini stub listening on {server.base_url} (latency {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Offline load test of the API. Starts the server against the Gemini stub, sends generated fixtures
+(benchmarks/fixtures.py) to every endpoint at several concurrency levels and reports throughput and
+p50/p95/p99 latency per endpoint, plus per pipeline stage and processing step from /metrics.
+Usage: python -m benchmarks.load [--concurrency 1 4 16] [--requests 40] [--scenarios upload-small explain ...]
+                                 [--gemini-latency 0.5] [--output results.json] [--baseline old.json]
+Pass --url to test a server that is already running instead (it should have CACHE_ENABLED=False).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.fixtures import build
+from benchmarks.gemini_stub import start_stub
+
+
+# Every request sends distinct input, so the server really does the work each time instead of
+# coalescing concurrent duplicates (app/singleflight.py) or reusing memoized explanations.
+
+def upload(field, name, content_type):
+    def request(fixtures, i):
+        items = fixtures[field]
+        # PNG and PDF readers ignore bytes after the end of the file
+        data = items[i % len(items)] + f"\n%request {i}\n".encode()
+        return {"files": {"file": (name, data, content_type)}}
+    return request
+
+
+def unique_expression(fixtures, i):
+    expression, format_type = fixtures["expressions"][i % len(fixtures["expressions"])]
+    return {"expression": f"{expression} + {i}", "format": format_type}
+
+
+def explain(fixtures, i):
+    return {"json": unique_expression(fixtures, i)}
+
+
+def explain_batch(fixtures, i, size=8):
+    return {"json": {"items": [unique_expression(fixtures, i * size + k) for k in range(size)]}}
+
+
+# name -> (endpoint path, request builder)
+SCENARIOS = {
+    "upload-small": ("/upload", upload("image_small", "eq.png", "image/png")),
+    "upload-medium": ("/upload", upload("image_medium", "eq.png", "image/png")),
+    "upload-photo": ("/upload", upload("image_photo", "eq.png", "image/png")),
+    "explain": ("/explain", explain),
+    "explain-batch": ("/explain/batch", explain_batch),
+    "pdf-text": ("/pdf-upload", upload("pdf_text", "notes.pdf", "application/pdf")),
+    "pdf-scanned": ("/pdf-upload", upload("pdf_scanned", "scan.pdf", "application/pdf")),
+    "math-image": ("/process-math-image", upload("image_medium", "eq.png", "image/png")),
+    "math-image-photo": ("/process-math-image", upload("image_photo", "eq.png", "image/png")),
+    "plot-image": ("/process-plot-image", upload("plot", "plot.png", "image/png")),
+    "math-image-stream": ("/process-math-image/stream", upload("image_medium", "eq.png", "image/png")),
+}
+
+
+# --- Statistics ---
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    k = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+            "mean": sum(values) / len(values), "max": max(values)}
+
+
+_SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_histograms(text, name):
+    """{labels (without le) -> {upper bound: cumulative count}} for one histogram in a /metrics scrape."""
+    histograms = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match or match.group(1) != f"{name}_bucket":
+            continue
+        labels = dict(_LABEL.findall(match.group(2) or ""))
+        bound = float(labels.pop("le"))
+        histograms.setdefault(tuple(sorted(labels.items())), {})[bound] = float(match.group(3))
+    return histograms
+
+
+def histogram_quantile(buckets, q):
+    """Estimate a quantile from cumulative bucket counts, interpolating inside the bucket like Prometheus."""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    if total <= 0:
+        return None
+    rank = q * total
+    lower, below = 0.0, 0.0
+    for bound in bounds:
+        if buckets[bound] >= rank:
+            if bound == float("inf"):
+                return lower
+            inside = buckets[bound] - below
+            return lower + (bound - lower) * ((rank - below) / inside if inside else 1.0)
+        lower, below = bound, buckets[bound]
+    return lower
+
+
+def histogram_delta(before, after, name, endpoint, group_by):
+    """Per `group_by` label: count and p50/p95/p99 of observations made between two scrapes."""
+    old, new = parse_histograms(before, name), parse_histograms(after, name)
+    result = {}
+    for labels, buckets in new.items():
+        labels_dict = dict(labels)
+        if labels_dict.get("endpoint") != endpoint:
+            continue
+        previous = old.get(labels, {})
+        delta = {bound: count - previous.get(bound, 0.0) for bound, count in buckets.items()}
+        count = delta[float("inf")]
+        if count <= 0:
+            continue
+        result[labels_dict[group_by]] = {
+            "count": int(count),
+            **{f"p{int(q * 100)}": histogram_quantile(delta, q) for q in (0.5, 0.95, 0.99)},
+        }
+    return result
+
+
+# --- Load generation ---
+
+async def run_scenario(client, fixtures, name, concurrency, total):
+    path, build_request = SCENARIOS[name]
+    await send(client, path, build_request(fixtures, 0))  # Warm-up, not counted
+    before = (await client.get("/metrics")).text
+
+    latencies, errors, next_index = [], [], iter(range(total))
+
+    async def worker():
+        for i in next_index:
+            start = time.perf_counter()
+            error = await send(client, path, build_request(fixtures, i))
+            latencies.append(time.perf_counter() - start)
+            if error:
+                errors.append(error)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = (await client.get("/metrics")).text
+
+    return {
+        "scenario": name,
+        "endpoint": path,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": len(errors),
+        "error_sample": errors[0] if errors else None,
+        "duration": elapsed,
+        "throughput": total / elapsed,
+        "latency": summarize(latencies),
+        "stages": histogram_delta(before, after, "stem_stage_duration_seconds", path, "stage"),
+        "stage_wait": histogram_delta(before, after, "stem_stage_wait_seconds", path, "stage"),
+        "steps": histogram_delta(before, after, "stem_step_duration_seconds", path, "step"),
+    }
+
+
+async def send(client, path, request):
+    """POST one request; returns an error description, or None if it succeeded."""
+    try:
+        response = await client.post(path, **request)
+    except httpx.HTTPError as e:
+        return f"{type(e).__name__}: {e}"
+    if response.status_code >= 400:
+        return f"HTTP {response.status_code}: {response.text[:200]}"
+    if response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        if isinstance(body, dict) and body.get("success") is False:
+            return f"success=false: {body.get('error')}"
+    elif "event: error" in response.text:
+        return "stream error event"
+    return None
+
+
+# --- Server ---
+
+def start_server(port, env_overrides):
+    env = {**os.environ, **env_overrides}
+    log = tempfile.NamedTemporaryFile(prefix="bench-server-", suffix=".log", delete=False)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.api:app", "--host", "127.0.0.1", "--port", str(port)],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+        start_new_session=True,  # Its own process group, so stop_server() also reaches the worker pools
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if httpx.get(url + "/", timeout=1).status_code == 200:
+                return process, url, log.name
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Server did not start, see {log.name}")
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(process.pid, signal.SIGKILL)  # Whatever is left of the group (pool workers)
+    except ProcessLookupError:
+        pass
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- Reporting ---
+
+def ms(value):
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+def print_result(result):
+    latency = result["latency"]
+    print(f"{result['scenario']:<18} {result['concurrency']:>4} {result['throughput']:>8.1f} "
+          f"{ms(latency['p50']):>7} {ms(latency['p95']):>7} {ms(latency['p99']):>7} {result['errors']:>6}")
+    for kind, label in (("stages", "stage"), ("stage_wait", "wait"), ("steps", "step")):
+        for name, stats in sorted(result[kind].items()):
+            print(f"{'':<4}{label:<5} {name:<16} n={stats['count']:<5} p50 {ms(stats['p50'])} ms, "
+                  f"p95 {ms(stats['p95'])} ms, p99 {ms(stats['p99'])} ms")
+    if result["error_sample"]:
+        print(f"    first error: {result['error_sample']}")
+
+
+def compare(results, baseline_path, tolerance):
+    """Print scenarios whose p95 grew by more than `tolerance` against a previous run; returns how many."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"\nAgainst {baseline_path} (p95, tolerance {tolerance:.0%}):")
+    for result in results:
+        old = baseline.get((result["scenario"], result["concurrency"]))
+        if old is None or not old["latency"]["p95"] or result["latency"]["p95"] is None:
+            continue
+        ratio = result["latency"]["p95"] / old["latency"]["p95"]
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        regressions += bool(flag)
+        print(f"  {result['scenario']:<18} c={result['concurrency']:<4} {ms(old['latency']['p95']):>7} -> "
+              f"{ms(result['latency']['p95']):>7} ms ({ratio:.2f}x) {flag}")
+    return regressions
+
+
+async def run_all(url, fixtures, scenarios, concurrencies, total, timeout):
+    results = []
+    async with httpx.AsyncClient(base_url=url, timeout=timeout,
+                                 limits=httpx.Limits(max_connections=max(concurrencies))) as client:
+        print(f"\n{'scenario':<18} {'conc':>4} {'req/s':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'errors':>6}")
+        for name in scenarios:
+            for concurrency in concurrencies:
+                result = await run_scenario(client, fixtures, name, concurrency, max(total, concurrency))
+                print_result(result)
+                results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=40, help="Requests per scenario and concurrency level")
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--gemini-jitter", type=float, default=0.1)
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="Use a running server instead of starting one (and the Gemini stub)")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="Extra server settings")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 growth before flagging")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    fixtures = build(variants=max(args.concurrency), pdf_pages=args.pdf_pages, seed=args.seed)
+    print(f"Generated fixtures in {time.perf_counter() - start:.1f}s")
+
+    server_env = {}
+    process = stub = None
+    url = args.url
+    if url is None:
+        stub = start_stub(latency=args.gemini_latency, jitter=args.gemini_jitter)
+        jobs_dir = tempfile.mkdtemp(prefix="bench-jobs-")
+        # Every request must do its work: no result cache, and a throwaway job store
+        server_env = {"GEMINI_API_BASE": stub.base_url, "GOOGLE_API_KEY": "stub", "CACHE_ENABLED": "False",
+                      "JOBS_DIR": jobs_dir}
+        server_env.update(item.split("=", 1) for item in args.env)
+        process, url, log_path = start_server(args.port, server_env)
+        print(f"Server on {url} (log: {log_path}), Gemini stub latency {args.gemini_latency}s")
+
+    try:
+        results = asyncio.run(run_all(url, fixtures, args.scenarios, args.concurrency, args.requests, args.timeout))
+    finally:
+        if process is not None:
+            stop_server(process)
+        if stub is not None:
+            stub.shutdown()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "server_env": server_env,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# /gunicorn.conf.py
+# Production server settings: Gunicorn supervising Uvicorn workers. `python main.py` runs
+# `gunicorn -c gunicorn.conf.py app.api:app`; every value can be overridden with the environment
+# variables in app/config.py (or Gunicorn's own command-line flags).
+
+import os
+
+from app.serving import available_cpus, default_web_workers
+
+# Decided before app.config is imported, since the per-worker pool sizes are derived from it
+os.environ.setdefault(
+    "WEB_CONCURRENCY", str(default_web_workers(available_cpus(), int(os.getenv("OCR_THREADS", 1)))),
+)
+
+from app import lazy  # noqa: E402
+from app.config import (  # noqa: E402
+    HOST, PORT, WARM_UP_IMPORTS, CPU_COUNT, OCR_THREADS, WEB_CONCURRENCY, CPU_WORKERS,
+    SERVER_PRELOAD, SERVER_MAX_REQUESTS, SERVER_MAX_REQUESTS_JITTER, SERVER_GRACEFUL_TIMEOUT,
+    SERVER_TIMEOUT, SERVER_KEEPALIVE,
+)
+
+bind = os.getenv("BIND", f"{HOST}:{PORT}")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = WEB_CONCURRENCY
+
+# Import the app in the master so workers are forked with it (and, see when_ready, the heavy
+# libraries) already loaded; the pages are shared copy-on-write instead of loaded once per worker
+preload_app = SERVER_PRELOAD
+
+# Recycle each worker after a bounded number of requests to cap slow leaks. The jitter staggers
+# the restarts so the workers never all restart at once.
+max_requests = SERVER_MAX_REQUESTS
+max_requests_jitter = SERVER_MAX_REQUESTS_JITTER
+
+# On SIGTERM/SIGHUP or a recycle, a worker stops accepting connections and finishes in-flight
+# requests (running jobs go back to the queue) before it is killed
+graceful_timeout = SERVER_GRACEFUL_TIMEOUT
+# A worker whose event loop has not checked in for this long is killed and replaced
+timeout = SERVER_TIMEOUT
+keepalive = SERVER_KEEPALIVE
+
+
+def when_ready(server):
+    server.log.info(
+        f"{CPU_COUNT} cores: {WEB_CONCURRENCY} workers x {CPU_WORKERS} CPU pool processes, "
+        f"{OCR_THREADS} Tesseract thread(s) per call"
+    )
+    if preload_app and WARM_UP_IMPORTS:
+        # The master has no other threads, so importing here (unlike in a worker) is safe to fork from
+        timings = lazy.warm_up()
+        loaded = [name for name, seconds in timings.items() if not isinstance(seconds, str)]
+        server.log.info(f"Preloaded {len(loaded)} libraries before forking workers")
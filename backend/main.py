@@ -1,6 +1,16 @@
-import uvicorn
-from app.api import app
+# /main.py
+# Server entry point. With DEBUG, runs a single auto-reloading Uvicorn process; otherwise replaces
+# itself with Gunicorn managing Uvicorn workers, configured by gunicorn.conf.py.
+
+import os
+import sys
+
 from app.config import HOST, PORT, DEBUG
 
-# if __name__ == "__main__":
-#     uvicorn.run("app.api:app", host=HOST, port=PORT, reload=DEBUG)
\ No newline at end of file
+if __name__ == "__main__":
+    if DEBUG:
+        import uvicorn
+        uvicorn.run("app.api:app", host=HOST, port=PORT, reload=True)
+    else:
+        config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+        os.execvp(sys.executable, [sys.executable, "-m", "gunicorn", "-c", config, *sys.argv[1:], "app.api:app"])
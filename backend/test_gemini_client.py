@@ -0,0 +1,98 @@
+"""
+Test the async Gemini client against the local stub server (no API key or network needed).
+Usage: python test_gemini_client.py   (or: python -m pytest test_gemini_client.py)
+"""
+
+import asyncio
+import io
+
+import httpx
+from PIL import Image
+
+from app.gemini import GeminiClient, GeminiKeyError
+from benchmarks.gemini_stub import DEFAULT_RESPONSES, start_stub
+
+
+def sample_image():
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 32), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_generate_content_reuses_connections():
+    """Several calls should get the canned texts back over a single kept-alive connection."""
+    print("\n--- Testing Gemini client against stub ---")
+    stub = start_stub(latency=0.05)
+    client = GeminiClient(api_key="stub", base_url=stub.base_url, max_connections=4)
+
+    async def run():
+        model = client.model("gemini-1.5-flash")
+        assert client.model("gemini-1.5-flash") is model
+        texts = [await model.generate_content("Describe", sample_image()) for _ in range(3)]
+        await client.aclose()
+        return texts
+
+    try:
+        texts = asyncio.run(run())
+    finally:
+        stub.shutdown()
+
+    print(f"Responses: {[text[:30] for text in texts]}")
+    print(f"Requests: {stub.requests}, connections: {len(stub.connections)}")
+    assert texts[0] == DEFAULT_RESPONSES[0]
+    assert stub.requests == 3
+    assert len(stub.connections) == 1
+
+
+def test_generate_content_timeout():
+    """A call slower than its timeout should be cancelled with a TimeoutError."""
+    print("\n--- Testing Gemini client timeout ---")
+    stub = start_stub(latency=1.0)
+    client = GeminiClient(api_key="stub", base_url=stub.base_url)
+
+    async def run():
+        try:
+            await client.model().generate_content("Describe", sample_image(), timeout=0.2)
+        except asyncio.TimeoutError:
+            return True
+        finally:
+            await client.aclose()
+        return False
+
+    try:
+        timed_out = asyncio.run(run())
+    finally:
+        stub.shutdown()
+
+    print(f"Timed out: {timed_out}")
+    assert timed_out
+
+
+def test_check_model_only_rejects_the_key_on_key_errors():
+    """A rate limit or timeout while checking the key should not be taken for a bad key."""
+    print("\n--- Testing Gemini key check ---")
+
+    async def check(status):
+        client = GeminiClient(api_key="stub", base_url="http://stub")
+        client._http = httpx.AsyncClient(base_url=client.base_url,
+                                         transport=httpx.MockTransport(lambda request: httpx.Response(status)))
+        try:
+            await client.check_model()
+        except GeminiKeyError:
+            return "key"
+        except httpx.HTTPStatusError:
+            return "error"
+        finally:
+            await client.aclose()
+        return "ok"
+
+    results = {status: asyncio.run(check(status)) for status in (200, 400, 401, 403, 404, 408, 429, 503)}
+    print(f"Results: {results}")
+    assert results == {200: "ok", 400: "key", 401: "key", 403: "key", 404: "key",
+                       408: "error", 429: "error", 503: "error"}
+
+
+if __name__ == "__main__":
+    test_generate_content_reuses_connections()
+    test_generate_content_timeout()
+    test_check_model_only_rejects_the_key_on_key_errors()
@@ -0,0 +1,49 @@
+"""
+Check the shared image loader (app/images.py): the pixel budget and reduced-scale JPEG decoding.
+Usage: python test_images.py   (or: python -m pytest test_images.py)
+"""
+
+import io
+
+from PIL import Image
+
+from app.images import ImageTooLarge, check_image, load_image
+
+
+def encode(img, format):
+    buffer = io.BytesIO()
+    img.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def test_pixel_budget_rejects_from_header():
+    print("\n--- Testing the pixel budget ---")
+    bomb = encode(Image.new("1", (20000, 20000)), "PNG")  # 400 MP, but only a few KB compressed
+    print(f"Decompression bomb: {len(bomb)} bytes")
+    for check in (check_image, load_image):
+        try:
+            check(bomb)
+        except ImageTooLarge as e:
+            print(f"{check.__name__}: {e.status_code} {e.detail}")
+            assert e.status_code == 413
+        else:
+            raise AssertionError(f"{check.__name__} accepted an image over the budget")
+    check_image(b"not an image")  # Left for the pipeline to report
+
+
+def test_jpeg_draft_decoding():
+    print("\n--- Testing reduced-scale JPEG decoding ---")
+    photo = encode(Image.new("RGB", (4000, 3000), "white"), "JPEG")
+    img, stored_size = load_image(photo, max_side=1536)
+    print(f"{stored_size} decoded at {img.size}")
+    assert stored_size == (4000, 3000)
+    assert img.size == (2000, 1500)  # Half scale is the smallest that still covers 1536 pixels
+    img, _ = load_image(photo, max_pixels=4_000_000, mode="L")
+    assert img.mode == "L" and img.width * img.height >= 4_000_000
+    img, _ = load_image(encode(Image.new("RGB", (4000, 3000), "white"), "PNG"), max_side=1536)
+    assert img.size == (4000, 3000)  # Other formats decode at full size
+
+
+if __name__ == "__main__":
+    test_pixel_budget_rejects_from_header()
+    test_jpeg_draft_decoding()
@@ -0,0 +1,52 @@
+"""
+Check that importing the API stays fast: no heavy libraries and no network calls at import time.
+Usage: python test_import_time.py   (or: python -m pytest test_import_time.py)
+Set IMPORT_BUDGET_SECONDS to change the allowed cold import time (default 2.0).
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", 2.0))
+
+# Loaded on first use or by the startup warm-up (app/lazy.py), never by `import app.api`
+HEAVY_MODULES = ["sympy", "numpy", "fitz", "PIL", "pytesseract", "twilio", "httpx", "google.generativeai"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.api
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+def cold_import():
+    """Import app.api in a fresh interpreter; the API key points at a closed port, so any network call fails."""
+    env = {**os.environ, "GOOGLE_API_KEY": "test", "GEMINI_API_BASE": "http://127.0.0.1:9",
+           "PYTHONDONTWRITEBYTECODE": "1"}
+    output = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, timeout=60,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_loads_no_heavy_modules():
+    print("\n--- Testing modules loaded by `import app.api` ---")
+    result = cold_import()
+    print(f"Heavy modules loaded: {result['loaded']}")
+    assert result["loaded"] == []
+
+
+def test_import_time_budget():
+    print("\n--- Testing cold import time ---")
+    # Best of three, so one slow run on a busy machine doesn't fail the test
+    seconds = min(cold_import()["seconds"] for _ in range(3))
+    print(f"Cold import: {seconds:.2f}s (budget {IMPORT_BUDGET_SECONDS:.2f}s)")
+    assert seconds < IMPORT_BUDGET_SECONDS
+
+
+if __name__ == "__main__":
+    test_import_loads_no_heavy_modules()
+    test_import_time_budget()
@@ -0,0 +1,144 @@
+"""
+Check region-level OCR: the layout step (app/layout.py) and the parallel recognition in app/ocr.py.
+Tesseract is replaced by a stand-in that reports which part of the page it was given.
+Usage: python test_layout.py   (or: python -m pytest test_layout.py)
+"""
+
+import asyncio
+import io
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app import executor, ocr
+from app.layout import find_regions
+from app.preprocess import estimate_line_height
+
+LINE = 30  # Height of a text line on the generated page
+GAP = 15  # Space between lines of a block
+BLOCK_GAP = 120  # Space between blocks
+
+
+def worksheet(size=(1400, 1800)):
+    """A title over two columns of three blocks each, with lines drawn as rows of "words".
+
+    Returns the page and the top-left corner of every block, in reading order.
+    """
+    img = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((100, 60, 1300, 60 + LINE), fill=0)
+    blocks = [(100, 60)]
+    for x in (100, 760):
+        y = 200
+        for _ in range(3):
+            blocks.append((x, y))
+            for _ in range(4):
+                for word_x in range(x, x + 520, 90):
+                    draw.rectangle((word_x, y, word_x + 70, y + LINE), fill=0)
+                y += LINE + GAP
+            y += BLOCK_GAP
+    return img, blocks
+
+
+def test_regions_in_reading_order():
+    print("\n--- Testing layout analysis ---")
+    img, blocks = worksheet()
+    mask = np.asarray(img) < 128
+    line_height = estimate_line_height(mask)
+    regions = find_regions(mask, line_height, max_regions=8)
+    print(f"Line height {line_height}, regions: {regions}")
+    # The title first, then the left column top to bottom, then the right column
+    assert [(left, top) for left, top, _, _ in regions] == blocks
+
+    regions = find_regions(mask, line_height, max_regions=2)
+    print(f"Regions with two workers: {regions}")
+    assert len(regions) == 3 and regions[1][2] < regions[2][0]  # Blocks of a column are joined, columns are not
+
+    assert find_regions(np.zeros((100, 100), dtype=bool), 10, 4) == []
+
+
+class SlowBackend:
+    """Stands in for Tesseract: reads every region as its size."""
+
+    name = "fake"
+
+    def __init__(self, seconds=0.2):
+        self.seconds = seconds
+        self.threads = set()
+
+    def recognize(self, img):
+        self.threads.add(threading.get_ident())
+        time.sleep(self.seconds)  # Like Tesseract, runs without holding the GIL
+        return f"{img.width} x {img.height}", 90.0, [(f"{img.width} x {img.height}", 90.0)]
+
+
+def run_ocr(image_data, workers, backend):
+    with mock.patch.multiple(ocr, OCR_REGION_WORKERS=4, OCR_LAYOUT_MIN_PIXELS=0, get_ocr_backend=lambda: backend):
+        return ocr.ocr_image_lines(image_data, workers=workers)
+
+
+def test_parallel_region_ocr():
+    print("\n--- Testing parallel region OCR ---")
+    img, blocks = worksheet()
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+
+    backend = SlowBackend()
+    start = time.perf_counter()
+    text, confidence, lines, regions = run_ocr(buffer.getvalue(), 4, backend)
+    elapsed = time.perf_counter() - start
+    print(f"{len(regions)} regions on {len(backend.threads)} threads in {elapsed:.2f}s:\n{text}")
+    assert len(regions) == len(blocks) and len(backend.threads) == 4
+    assert elapsed < len(blocks) * backend.seconds * 0.75
+    assert confidence == 90.0 and len(lines) == len(blocks)
+    assert text.split("\n\n") == [region_text for region_text, _ in regions]
+    sizes = [tuple(int(v) for v in region_text.split(" x ")) for region_text, _ in regions]
+    assert sizes[0][0] > 10 * sizes[0][1] and len(set(sizes[1:])) == 1  # The title, then the equal blocks
+
+    backend = SlowBackend(seconds=0)
+    _, _, _, serial_regions = run_ocr(buffer.getvalue(), 1, backend)
+    # No idle workers: the same regions, read one after the other
+    assert serial_regions == regions and len(backend.threads) == 1
+
+
+def test_fan_out_reserves_idle_workers():
+    print("\n--- Testing fan-out over idle workers ---")
+    stage = executor.Stage("ocr", "cpu", 4)
+
+    def read_page(workers=1):
+        time.sleep(0.2)
+        return workers
+
+    async def pages():
+        first = asyncio.create_task(stage.run_wide(read_page, 4))
+        await asyncio.sleep(0.05)
+        # The first page took the three idle workers, so the second finds none left to spread over
+        second = await stage.run_wide(read_page, 4)
+        return await first, second, executor.idle_cpu_workers()
+
+    with mock.patch.multiple(executor, STAGES={"ocr": stage}, CPU_EXECUTOR="thread", CPU_WORKERS=4, _executors={}):
+        widths = asyncio.run(pages())
+        executor.shutdown_executors()
+    print(f"Workers per page: {widths[:2]}, idle afterwards: {widths[2]}")
+    assert widths == (4, 1, 4)
+
+
+def test_merge_weights_confidence_by_words():
+    text, confidence, lines, regions = ocr.merge_regions([
+        ("one two three", 90.0, [("one two three", 90.0)]),
+        ("", None, []),
+        ("four", 50.0, [("four", 50.0)]),
+    ])
+    assert text == "one two three\n\nfour"
+    assert confidence == 80.0
+    assert regions == [("one two three", 90.0), ("four", 50.0)]
+
+
+if __name__ == "__main__":
+    test_regions_in_reading_order()
+    test_parallel_region_ocr()
+    test_fan_out_reserves_idle_workers()
+    test_merge_weights_confidence_by_words()
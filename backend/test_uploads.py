@@ -0,0 +1,79 @@
+"""
+Check the upload ingestion layer (app/uploads.py): size limits, spooling and base64 decoding.
+Usage: python test_uploads.py   (or: python -m pytest test_uploads.py)
+"""
+
+import asyncio
+import base64
+import os
+import tempfile
+import tracemalloc
+
+from starlette.datastructures import UploadFile
+
+from app.uploads import UploadTooLarge, decode_base64, ingest
+
+MB = 1024 * 1024
+
+
+def upload_file(size):
+    """An UploadFile like the one FastAPI passes to endpoints, already spooled to disk."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=MB)
+    for _ in range(size // MB):
+        spooled.write(os.urandom(MB))
+    spooled.seek(0)
+    return UploadFile(spooled, size=size, filename="upload.bin")
+
+
+def peak_ingest_memory(size):
+    file = upload_file(size)
+    tracemalloc.start()
+    try:
+        upload = asyncio.run(ingest(file, limit=size))
+        with upload.view() as view:
+            assert len(view) == size
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_ingest_memory_is_flat():
+    print("\n--- Testing peak memory while ingesting uploads ---")
+    peak_ingest_memory(2 * MB)  # Warm up imports and caches
+    small, large = peak_ingest_memory(4 * MB), peak_ingest_memory(64 * MB)
+    print(f"Peak allocations: 4 MB upload {small / MB:.1f} MB, 64 MB upload {large / MB:.1f} MB")
+    assert large < 2 * MB
+
+
+def test_ingest_enforces_limit():
+    print("\n--- Testing the upload size limit ---")
+    try:
+        asyncio.run(ingest(upload_file(3 * MB), limit=2 * MB))
+    except UploadTooLarge as e:
+        print(f"Rejected: {e.status_code} {e.detail}")
+        assert e.status_code == 413
+    else:
+        raise AssertionError("oversized upload was accepted")
+
+
+def test_decode_base64_in_chunks():
+    print("\n--- Testing chunked base64 decoding ---")
+    data = os.urandom(3 * MB + 1)
+    encoded = base64.b64encode(data).decode("ascii")
+    wrapped = "\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))  # MIME-style line breaks
+    upload = decode_base64(wrapped, limit=4 * MB, chunk_chars=1000)
+    with upload.view() as view:
+        assert bytes(view) == data
+    print(f"Decoded {upload}")
+    try:
+        decode_base64(encoded[:-1])
+    except Exception as e:
+        print(f"Truncated input rejected: {e}")
+    else:
+        raise AssertionError("truncated base64 was accepted")
+
+
+if __name__ == "__main__":
+    test_ingest_memory_is_flat()
+    test_ingest_enforces_limit()
+    test_decode_base64_in_chunks()